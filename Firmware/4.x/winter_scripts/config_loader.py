@@ -5,23 +5,212 @@ external CSV files found under `/media` or `/mnt` before falling back to
 the repository defaults (matching existing code behavior).
 """
 import csv
+import io
 import os
+import sys
+import time
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 
+# pyarrow is imported on first use, and only for settings files over
+# FAST_READ_THRESHOLD, so ordinary config consumers never load it.
+pa = None
+pac = None
+_pyarrow_import_failed = False
 
-def find_external_file(filename, search_paths=("/media", "/mnt"), depth=1):
-    """Search top-level of mounted external media for `filename`.
+DEFAULT_SEARCH_PATHS = ("/media", "/mnt")
 
-    Returns full path if found, otherwise None.
+# Settings files larger than this are parsed with pyarrow when it is installed;
+# below it the import/setup cost outweighs the faster parser.
+FAST_READ_THRESHOLD = 1 << 16
+
+_CAMERA_NAME = "camera_settings.csv"
+_CAMERA_DEFAULT = "/home/pi/Desktop/Mothbox/camera_settings.csv"
+_SCHEDULE_NAME = "schedule_settings.csv"
+_SCHEDULE_DEFAULT = "/home/pi/Desktop/Mothbox/schedule_settings.csv"
+_DEFAULT_PATHS = {_CAMERA_NAME: _CAMERA_DEFAULT, _SCHEDULE_NAME: _SCHEDULE_DEFAULT}
+
+
+def _existing_bases(paths=DEFAULT_SEARCH_PATHS):
+    return tuple(b for b in paths if os.path.isdir(b))
+
+
+# Mount roots that exist on this system, resolved once at import.
+_SEARCH_BASES = _existing_bases()
+
+# Seconds a failed lookup is remembered before the mounts are walked again.
+NEGATIVE_CACHE_TTL = 5.0
+
+_neg_cache = {}  # (search_paths, filename, depth) -> monotonic time of last miss
+_hit_cache = {}  # (search_paths, filename, depth) -> (path, parent dir st_mtime_ns)
+
+
+def find_external_file(filename, search_paths=DEFAULT_SEARCH_PATHS, depth=1, first_match=True):
+    """Search mounted external media for `filename`.
+
+    Looks `depth` directory levels below each search path (1 = the top-level
+    mount directories only). Returns the first full path found, otherwise
+    None. Hits are remembered until their directory changes and misses for
+    `NEGATIVE_CACHE_TTL` seconds, so back-to-back loaders don't repeat the
+    same walk. `find_external_file.cache_clear()` forgets both.
+
+    With `first_match=False` a generator over every match is returned instead
+    (not cached).
     """
-    for base in search_paths:
-        if not os.path.isdir(base):
+    if not first_match:
+        return (path for _, path in _iter_external((filename,), search_paths, depth))
+    return _find_external((filename,), search_paths, depth).get(filename)
+
+
+def _cached_lookup(key):
+    """Return `(known, path)` for one lookup from the hit and miss caches."""
+    hit = _hit_cache.get(key)
+    if hit is not None:
+        # Any create/delete/rename in the hit's directory bumps its mtime, so
+        # an unchanged mtime means the cached path is still there.
+        path, mtime_ns = hit
+        try:
+            if os.stat(os.path.dirname(path)).st_mtime_ns == mtime_ns:
+                return True, path
+        except OSError:
+            pass
+        del _hit_cache[key]
+    if time.monotonic() - _neg_cache.get(key, float("-inf")) < NEGATIVE_CACHE_TTL:
+        return True, None
+    return False, None
+
+
+def _find_external(names, search_paths=DEFAULT_SEARCH_PATHS, depth=1):
+    """Cached lookup of several file names with a single walk of the mounts.
+
+    Names the hit/miss caches can answer are not searched again; the rest
+    share one pass over the search paths. Returns a dict name->path holding
+    only the names found.
+    """
+    search_paths = tuple(search_paths)
+    found = {}
+    todo = []
+    for name in names:
+        known, path = _cached_lookup((search_paths, name, depth))
+        if not known:
+            todo.append(name)
+        elif path:
+            found[name] = path
+    if not todo:
+        return found
+
+    scanned = {}
+    for name, candidate in _iter_external(todo, search_paths, depth):
+        # first match per name wins, same as a walk for that name alone
+        scanned.setdefault(name, candidate)
+        if len(scanned) == len(todo):
+            break
+    now = time.monotonic()
+    for name in todo:
+        key = (search_paths, name, depth)
+        candidate = scanned.get(name)
+        if candidate is None:
+            _neg_cache[key] = now
             continue
-        for entry in os.listdir(base):
-            candidate = os.path.join(base, entry, filename)
-            if os.path.isfile(candidate):
-                return candidate
-    return None
+        _neg_cache.pop(key, None)
+        try:
+            _hit_cache[key] = (candidate, os.stat(os.path.dirname(candidate)).st_mtime_ns)
+        except OSError:
+            pass
+        found[name] = candidate
+    return found
+
+
+def _iter_external(names, search_paths, depth):
+    for base in search_paths:
+        yield from _iter_dir(base, names, depth)
+
+
+def _iter_dir(base, names, depth):
+    """Yield `(name, path)` for each of `names` found `depth` levels below `base`."""
+    try:
+        it = os.scandir(base)
+    except OSError:
+        # missing or unreadable mount point
+        return
+    with it:
+        for entry in it:
+            # scandir caches the entry type, so non-directories cost no stat
+            if not entry.is_dir():
+                continue
+            for name in names:
+                candidate = os.path.join(entry.path, name)
+                # cheap existence probe on the miss-heavy path; confirm it's a file on hit
+                if os.access(candidate, os.F_OK) and os.path.isfile(candidate):
+                    yield name, candidate
+            if depth > 1:
+                yield from _iter_dir(entry.path, names, depth - 1)
+
+
+def _clear_external_file_cache():
+    _neg_cache.clear()
+    _hit_cache.clear()
+
+
+find_external_file.cache_clear = _clear_external_file_cache
+
+
+def refresh_search_bases():
+    """Re-check which of `DEFAULT_SEARCH_PATHS` exist (e.g. after hot-plug)."""
+    global _SEARCH_BASES
+    _SEARCH_BASES = _existing_bases()
+    find_external_file.cache_clear()
+    return _SEARCH_BASES
+
+
+def _load_pyarrow():
+    global pa, pac, _pyarrow_import_failed
+    if pac is None and not _pyarrow_import_failed:
+        try:
+            import pyarrow as _pa
+            import pyarrow.csv as _pac
+        except ImportError:
+            _pyarrow_import_failed = True
+        else:
+            pa, pac = _pa, _pac
+    return pac
+
+
+def _rows_to_settings(reader):
+    header = next(reader, None)
+    if not header or "SETTING" not in header or "VALUE" not in header:
+        return {}
+    si = header.index("SETTING")
+    vi = header.index("VALUE")
+    # plain csv.reader + index lookups avoids DictReader's per-row dict;
+    # keys and values are stripped like on the bytes path
+    return {
+        sys.intern(r[si].strip()): (r[vi].strip() if len(r) > vi else None)
+        for r in reader
+        if len(r) > si and r[si].strip()
+    }
+
+
+def _fast_read(buf, encoding):
+    """Parse a large settings CSV with pyarrow. Returns None if it can't."""
+    try:
+        table = pac.read_csv(
+            pa.BufferReader(buf),
+            read_options=pac.ReadOptions(block_size=1 << 20, encoding=encoding),
+            convert_options=pac.ConvertOptions(
+                include_columns=["SETTING", "VALUE"],
+                column_types={"SETTING": pa.string(), "VALUE": pa.string()},
+                strings_can_be_null=False,
+            ),
+        )
+    except (pa.ArrowException, ValueError):
+        return None
+    # stripped like the bytes path, so the result doesn't depend on file size
+    keys = [k.strip() for k in table.column("SETTING").to_pylist()]
+    values = table.column("VALUE").to_pylist()
+    return {sys.intern(k): v.strip() for k, v in zip(keys, values) if k}
 
 
 def read_setting_csv(path, encoding="utf-8"):
@@ -29,54 +218,152 @@ def read_setting_csv(path, encoding="utf-8"):
 
     Non-existing file -> returns empty dict.
     """
-    result = {}
     try:
-        with open(path, newline="", encoding=encoding) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                key = row.get("SETTING")
-                val = row.get("VALUE")
-                if key:
-                    result[key] = val
+        with open(path, "rb") as f:
+            buf = f.read()
     except FileNotFoundError:
         return {}
-    return result
+
+    if len(buf) > FAST_READ_THRESHOLD and _load_pyarrow() is not None:
+        result = _fast_read(buf, encoding)
+        if result is not None:
+            return result
+
+    lines = buf.splitlines()
+    header = lines[0].split(b",", 2) if lines else []
+    # The settings files are tiny and unquoted, so split the bytes directly;
+    # anything quoted or with a different column order goes through csv.
+    if b'"' in buf or [h.strip() for h in header[:2]] != [b"SETTING", b"VALUE"]:
+        text = io.StringIO(buf.decode(encoding), newline="")
+        return _rows_to_settings(csv.reader(text))
+
+    # Keys are interned: the same few dozen names repeat across every file and
+    # downstream lookups then compare by identity.
+    rows = (line.split(b",", 2) for line in lines[1:] if line)
+    return {
+        sys.intern(p[0].strip().decode(encoding)): (p[1].strip().decode(encoding) if len(p) > 1 else None)
+        for p in rows
+        if p[0].strip()
+    }
+
+
+def load_all_settings(names=(_CAMERA_NAME, _SCHEDULE_NAME), preferred_external=True):
+    """Load several settings CSVs with a single pass over the external mounts.
+
+    Returns a dict name->settings dict. Names without an external copy fall
+    back to the repository default path, or {} if there is none.
+    """
+    found = _find_external(names, _SEARCH_BASES) if preferred_external else {}
+    out = {}
+    for name in names:
+        path = found.get(name) or _DEFAULT_PATHS.get(name)
+        out[name] = read_setting_csv(path) if path else {}
+    return out
 
 
+@lru_cache(maxsize=4)
 def load_camera_settings(preferred_external=True):
     """Load camera settings. Prefer external media if available.
 
-    Returns a dict of setting->value.
+    Returns a dict of setting->value. Results are cached for the life of the
+    process; call `load_camera_settings.cache_clear()` to force a reload.
+    Treat the returned dict as read-only since it is shared between callers.
     """
-    default = "/home/pi/Desktop/Mothbox/camera_settings.csv"
-    if preferred_external:
-        ext = find_external_file("camera_settings.csv")
-        if ext:
-            return read_setting_csv(ext)
-    return read_setting_csv(default)
+    return load_all_settings((_CAMERA_NAME,), preferred_external)[_CAMERA_NAME]
 
 
+@lru_cache(maxsize=4)
 def load_schedule_settings(preferred_external=True):
-    default = "/home/pi/Desktop/Mothbox/schedule_settings.csv"
-    if preferred_external:
-        ext = find_external_file("schedule_settings.csv")
-        if ext:
-            return read_setting_csv(ext)
-    return read_setting_csv(default)
+    """Load schedule settings, cached like `load_camera_settings`."""
+    return load_all_settings((_SCHEDULE_NAME,), preferred_external)[_SCHEDULE_NAME]
+
+
+@dataclass(frozen=True, slots=True)
+class CameraSettings:
+    """Typed view of the `SETTING,VALUE` camera keys used by the capture scripts.
+
+    Values are parsed once at load time; missing or empty settings take the
+    same defaults `rpicam-take.py` applies.
+    """
+    exposure_time: int = 1000
+    analogue_gain: Optional[float] = None
+    gain: Optional[float] = None
+    awb_gains: Optional[str] = None
+    width: int = 9248
+    height: int = 6944
+    target_mean: float = 100.0
+    loop_iterations: int = 5
+    retry_count: int = 2
+    min_exposure: int = 100
+    max_exposure: int = 240000000
+    tolerance_pct: float = 5.0
+    max_change_factor: float = 4.0
+    gamma_exponent: float = 2.2
+    gamma_transition_error: float = 0.10
+    gamma_transition_error_dark: float = 0.08
+    gamma_transition_error_normal: float = 0.10
+    gamma_transition_error_bright: float = 0.06
+    gamma_dark_threshold: float = 20.0
+    gamma_bright_threshold: float = 15.0
+
+
+# CSV SETTING name -> (CameraSettings field, parser)
+_CAMERA_FIELDS = {
+    "ExposureTime": ("exposure_time", int),
+    "AnalogueGain": ("analogue_gain", float),
+    "Gain": ("gain", float),
+    "AwbGains": ("awb_gains", str),
+    "Width": ("width", int),
+    "Height": ("height", int),
+    "TargetMean": ("target_mean", float),
+    "LoopIterations": ("loop_iterations", int),
+    "RetryCount": ("retry_count", int),
+    "MinExposure": ("min_exposure", int),
+    "MaxExposure": ("max_exposure", int),
+    "TolerancePct": ("tolerance_pct", float),
+    "MaxChangeFactor": ("max_change_factor", float),
+    "GammaExponent": ("gamma_exponent", float),
+    "GammaTransitionError": ("gamma_transition_error", float),
+    "GammaTransitionError_Dark": ("gamma_transition_error_dark", float),
+    "GammaTransitionError_Normal": ("gamma_transition_error_normal", float),
+    "GammaTransitionError_Bright": ("gamma_transition_error_bright", float),
+    "GammaDarkThreshold": ("gamma_dark_threshold", float),
+    "GammaBrightThreshold": ("gamma_bright_threshold", float),
+}
+
+
+def _build_camera(settings):
+    """Build a CameraSettings from a raw setting->value dict."""
+    kwargs = {}
+    for key, (field, parse) in _CAMERA_FIELDS.items():
+        raw = settings.get(key)
+        if raw:
+            kwargs[field] = parse(raw)
+    return CameraSettings(**kwargs)
+
+
+@lru_cache(maxsize=4)
+def load_camera_config(preferred_external=True):
+    """Like `load_camera_settings`, but returns a typed `CameraSettings`."""
+    return _build_camera(load_camera_settings(preferred_external))
 
 
 def read_controls(filepath):
     """Read a simple key=value control file into dict. Returns {} if missing."""
     out = {}
     try:
-        with open(filepath, "r") as f:
+        with open(filepath, "r", buffering=1 << 16) as f:
             for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
+                # blank and comment lines are skipped without stripping
+                if line[0] in "#\n\r":
+                    continue
+                eq = line.find("=")
+                if eq < 0:
+                    continue
+                k = line[:eq].strip()
+                if not k or k[0] == "#":
                     continue
-                if "=" in line:
-                    k, v = line.split("=", 1)
-                    out[k.strip()] = v.strip()
+                out[k] = line[eq + 1:].strip()
     except FileNotFoundError:
         return {}
     return out
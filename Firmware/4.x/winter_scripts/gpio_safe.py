@@ -3,41 +3,146 @@
 This module centralizes the OFF/DEBUG pin logic used across the repo.
 Do not change default pin numbers here without confirming with the owner.
 """
-try:
-    import RPi.GPIO as GPIO
-except Exception:
-    GPIO = None
+import os
+import time
+
+# RPi.GPIO is imported on first use so config-only consumers of this module
+# don't pay for loading the C extension.
+GPIO = None
+_gpio_import_failed = False
 
 OFF_PIN = 16
 DEBUG_PIN = 12
 
+# Pin reads are reused for this many seconds so tight loops wrapped by
+# `require_armed` don't hit the GPIO driver on every call.
+READ_TTL = 0.05
+
+# sysfs value file for a pin that the system has already exported. When
+# present it is read directly instead of going through RPi.GPIO.
+SYSFS_VALUE = "/sys/class/gpio/gpio{}/value"
+
+# libgpiod chip holding both pins. When the gpiod bindings are installed the
+# OFF and DEBUG lines are requested together and read with one ioctl.
+GPIOD_CHIP = "gpiochip0"
+GPIOD_CONSUMER = "mothbox"
+
+_bulk_lines = None
+_bulk_failed = False
+
+_configured = set()
+_last_read = {}  # pin -> (monotonic time, value)
+_sysfs_fds = {}  # pin -> open fd on its sysfs value file
+
+
+def _load_gpio():
+    global GPIO, _gpio_import_failed
+    if GPIO is None and not _gpio_import_failed:
+        try:
+            import RPi.GPIO as _gpio
+        except Exception:
+            _gpio_import_failed = True
+        else:
+            GPIO = _gpio
+    return GPIO
+
 
 def ensure_gpio():
-    if GPIO is None:
+    if _load_gpio() is None:
         raise RuntimeError("RPi.GPIO not available on this platform")
 
 
 def setup(pins=(OFF_PIN, DEBUG_PIN)):
     ensure_gpio()
+    pending = [p for p in pins if p not in _configured]
+    if not pending:
+        return
     GPIO.setmode(GPIO.BCM)
-    for p in pins:
+    for p in pending:
         GPIO.setup(p, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        _configured.add(p)
+        _open_sysfs(p)
+
+
+def _open_sysfs(pin):
+    try:
+        _sysfs_fds[pin] = os.open(SYSFS_VALUE.format(pin), os.O_RDONLY)
+    except OSError:
+        pass
+
+
+def _read_pin(pin):
+    fd = _sysfs_fds.get(pin)
+    if fd is not None:
+        try:
+            return 0 if os.pread(fd, 1, 0) == b"0" else 1
+        except OSError:
+            os.close(fd)
+            del _sysfs_fds[pin]
+    return GPIO.input(pin)
+
+
+def _cached_input(pin, ttl=READ_TTL):
+    now = time.monotonic()
+    cached = _last_read.get(pin)
+    if cached is not None and now - cached[0] < ttl:
+        return cached[1]
+    if pin not in _configured:
+        setup((pin,))
+    value = _read_pin(pin)
+    _last_read[pin] = (now, value)
+    return value
 
 
 def is_off():
     """Returns True if the OFF pin is tied to ground (device should not operate)."""
-    if GPIO is None:
+    if _load_gpio() is None:
         return False
-    GPIO.setup(OFF_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-    return GPIO.input(OFF_PIN) == 0
+    return _cached_input(OFF_PIN) == 0
 
 
 def is_debug():
     """Returns True if the DEBUG pin is tied to ground."""
-    if GPIO is None:
+    if _load_gpio() is None:
         return False
-    GPIO.setup(DEBUG_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-    return GPIO.input(DEBUG_PIN) == 0
+    return _cached_input(DEBUG_PIN) == 0
+
+
+def _request_bulk():
+    global _bulk_lines, _bulk_failed
+    if _bulk_lines is None and not _bulk_failed:
+        try:
+            import gpiod
+
+            chip = gpiod.Chip(GPIOD_CHIP)
+            lines = chip.get_lines([OFF_PIN, DEBUG_PIN])
+            lines.request(consumer=GPIOD_CONSUMER, type=gpiod.LINE_REQ_DIR_IN,
+                          flags=gpiod.LINE_REQ_FLAG_BIAS_PULL_UP)
+        except Exception:
+            # bindings missing, or the lines are already claimed by RPi.GPIO
+            _bulk_failed = True
+        else:
+            _bulk_lines = lines
+    return _bulk_lines
+
+
+def read_state(ttl=READ_TTL):
+    """Return `(off, debug)` booleans, reading both pins in a single call.
+
+    Uses a libgpiod bulk request when available and falls back to
+    `is_off()` / `is_debug()` otherwise.
+    """
+    lines = _request_bulk()
+    if lines is None:
+        return is_off(), is_debug()
+    now = time.monotonic()
+    cached = _last_read.get(OFF_PIN), _last_read.get(DEBUG_PIN)
+    if all(c is not None and now - c[0] < ttl for c in cached):
+        return cached[0][1] == 0, cached[1][1] == 0
+    off, dbg = lines.get_values()
+    _last_read[OFF_PIN] = (now, off)
+    _last_read[DEBUG_PIN] = (now, dbg)
+    return off == 0, dbg == 0
 
 
 def require_armed(func):
@@ -47,7 +152,13 @@ def require_armed(func):
     """
 
     def wrapper(*args, **kwargs):
-        if is_off():
+        # a bulk request reads both lines in one ioctl anyway; without one,
+        # only the OFF pin is needed here
+        if _request_bulk() is not None:
+            off, _ = read_state()
+        else:
+            off = is_off()
+        if off:
             raise RuntimeError("Mothbox OFF pin active — aborting operation")
         return func(*args, **kwargs)
 
@@ -18,6 +18,10 @@ from pathlib import Path
 import os
 import math
 
+import numpy as np
+
+from picam_settle import set_controls_and_settle
+
 DEFAULT_SIZE = (9248, 6944)  # Arducam 64MP OwlSight OV64A40 max resolution
 
 
@@ -32,35 +36,27 @@ def parse_args():
     p.add_argument("--out-dir", default=os.environ.get('MOTHBOX_OUT', '/tmp/mothbox_ext'),
                    help="Output directory")
     p.add_argument("--dry-run", action='store_true', help="Do not access camera; print planned actions")
-    p.add_argument("--wait", type=float, default=0.5, help="Seconds to wait after setting controls before capture")
+    p.add_argument("--wait", type=float, default=0.0,
+                   help="Optional extra seconds to wait after the new controls show up in frame metadata (default 0)")
     return p.parse_args()
 
 
 def frange(start, stop, step):
-    vals = []
-    v = start
-    eps = 1e-12
     if step == 0:
         return [start]
-    if step > 0:
-        while v <= stop + eps:
-            vals.append(v)
-            v += step
-    else:
-        while v >= stop - eps:
-            vals.append(v)
-            v += step
-    return vals
+    # Count the steps up front and scale them, rather than accumulating
+    # `v += step`, so float drift can't drop or add the endpoint.
+    n = max(int(math.floor((stop - start) / step + 1e-9)) + 1, 0)
+    return (start + step * np.arange(n)).tolist()
 
 
 def linspace(start, stop, count):
     if count <= 1:
         return [start]
-    step = (stop - start) / (count - 1)
-    return [start + i * step for i in range(int(count))]
+    return np.linspace(start, stop, int(count)).tolist()
 
 
-def warn_about_ranges(ev, exptime_s):
+def ev_notes(ev):
     notes = []
     # Based on existing code in this repo and Picamera2/libcamera doc snippets:
     # - ExposureValue (EV) in this codebase is normally limited to about -8.0 .. 8.0
@@ -68,7 +64,11 @@ def warn_about_ranges(ev, exptime_s):
     #   by libcamera or ignored by the sensor driver.
     if ev < -8.0 or ev > 8.0:
         notes.append(f"EV {ev} outside typical Picamera2 range [-8,8] — may be clamped")
+    return notes
 
+
+def exposure_notes(exptime_s):
+    notes = []
     # ExposureTime in libcamera controls is in microseconds. Many sensors/drivers
     # limit max exposure time (often to a few seconds); extremely long exposures
     # like 1000s (16+ minutes) are unlikely to be supported in hardware by the
@@ -77,15 +77,18 @@ def warn_about_ranges(ev, exptime_s):
         notes.append(f"Exposure {exptime_s}s is very long; sensor/driver may not support >~30s")
     if exptime_s < 1/100:
         notes.append(f"Exposure {exptime_s}s shorter than 1/100s; sensor may not reach very high frame-rate in still mode")
-
     return notes
 
 
+def warn_about_ranges(ev, exptime_s):
+    return ev_notes(ev) + exposure_notes(exptime_s)
+
+
 def ensure_out_dir(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
 
-def run_capture_sequence(exposure_times_s, evs, out_dir, dry_run=False, wait=0.5):
+def run_capture_sequence(exposure_times_s, evs, out_dir, dry_run=False, wait=0.0):
     ensure_out_dir(out_dir)
 
     try:
@@ -107,47 +110,60 @@ def run_capture_sequence(exposure_times_s, evs, out_dir, dry_run=False, wait=0.5
         print("Try a smaller size or verify camera driver supports 9248x6944")
         return
 
-    for ex_s in exposure_times_s:
+    # EV is the AE-relative control and is slow to converge, so keep it in the
+    # outer loop and change it least often; only ExposureTime sweeps per capture.
+    # Warnings depend on EV and exposure separately; work them out once per value
+    # rather than once per grid point.
+    notes_by_ev = {ev: ev_notes(ev) for ev in evs}
+    notes_by_time = {ex_s: exposure_notes(ex_s) for ex_s in exposure_times_s}
+
+    # Start the pipeline once for the whole sweep; a start/stop per capture
+    # flushes several frames each time.
+    if not dry_run:
+        picam2.start()
+    try:
         for ev in evs:
-            notes = warn_about_ranges(ev, ex_s)
-            print("---")
-            print(f"Planned capture: exposure={ex_s}s, EV={ev}")
-            for n in notes:
-                print("WARN:", n)
-
-            if dry_run:
-                print("Dry-run: skip hardware capture")
-                continue
-
-            # Convert exposure time to microseconds for libcamera control
-            ex_us = int(round(ex_s * 1e6))
-
-            # Use manual exposure: disable AE then set ExposureTime and AnalogueGain/ExposureValue
-            # Note: some drivers require specific sequences; libcamera may clamp values.
-            try:
-                picam2.start()
-                picam2.set_controls({
-                    "AeEnable": False,
-                    "ExposureTime": ex_us,
-                    # Picamera2 doesn't expose a single 'ExposureValue' control universally;
-                    # the repo uses an 'ExposureValue' float for relative exposure adjustments.
-                    # We'll attempt to set 'ExposureValue' if supported, otherwise skip.
-                    "ExposureValue": float(ev),
-                })
-                # small settle time
-                time.sleep(wait)
-                ts = int(time.time())
-                fname = Path(out_dir) / f"picam2_test_ex{ex_s:.3f}s_ev{ev:+.2f}_{ts}.jpg"
-                # capture_file will request a still capture to the given path
-                picam2.capture_file(str(fname))
-                print("Captured ->", fname)
-            except Exception as e:
-                print("Capture failed:", e)
-            finally:
+            for ex_s in exposure_times_s:
+                notes = notes_by_ev[ev] + notes_by_time[ex_s]
+                print("---")
+                print(f"Planned capture: exposure={ex_s}s, EV={ev}")
+                for n in notes:
+                    print("WARN:", n)
+
+                if dry_run:
+                    print("Dry-run: skip hardware capture")
+                    continue
+
+                # Convert exposure time to microseconds for libcamera control
+                ex_us = int(round(ex_s * 1e6))
+
+                # Use manual exposure: disable AE then set ExposureTime and AnalogueGain/ExposureValue
+                # Note: some drivers require specific sequences; libcamera may clamp values.
                 try:
-                    picam2.stop()
-                except Exception:
-                    pass
+                    # drops frames until the new ExposureTime shows up in metadata
+                    set_controls_and_settle(picam2, {
+                        "AeEnable": False,
+                        "ExposureTime": ex_us,
+                        # Picamera2 doesn't expose a single 'ExposureValue' control universally;
+                        # the repo uses an 'ExposureValue' float for relative exposure adjustments.
+                        # We'll attempt to set 'ExposureValue' if supported, otherwise skip.
+                        "ExposureValue": float(ev),
+                    })
+                    if wait > 0:
+                        time.sleep(wait)
+                    ts = int(time.time())
+                    fname = Path(out_dir) / f"picam2_test_ex{ex_s:.3f}s_ev{ev:+.2f}_{ts}.jpg"
+                    # capture_file will request a still capture to the given path
+                    picam2.capture_file(str(fname))
+                    print("Captured ->", fname)
+                except Exception as e:
+                    print("Capture failed:", e)
+    finally:
+        if not dry_run:
+            try:
+                picam2.stop()
+            except Exception:
+                pass
 
 
 def main():
@@ -0,0 +1,92 @@
+"""Shared Picamera2 session helpers for the winter_scripts capture tools.
+
+Opening and closing a still session lives here so every script releases the
+camera the same way before falling back to `rpicam-still`.
+
+New controls take effect a few frames after `set_controls`, and the frames
+already in flight still report the previous exposure. Captures taken before
+the new ExposureTime lands would be metered or saved at the old setting.
+"""
+try:
+    from picamera2 import Picamera2
+except Exception:
+    Picamera2 = None
+
+# Max frames to drop while waiting for new controls to take effect
+SETTLE_MAX_FRAMES = 8
+# Reported exposure within this fraction of the request counts as applied
+SETTLE_TOLERANCE = 0.1
+
+
+def set_controls_and_settle(picam2, controls, max_frames=SETTLE_MAX_FRAMES, tolerance=SETTLE_TOLERANCE):
+    """Apply `controls` on a started session and drop frames until the new
+    ExposureTime is in effect; returns the last reported ExposureTime (or None).
+
+    The exposure reported just before `set_controls` is kept as a baseline.
+    A frame counts as settled once its exposure is within `tolerance` of the
+    request, or once it has moved off the baseline and then holds steady for
+    two frames (the sensor clamped the request). Stale frames still carrying
+    the baseline never end the wait early; at most `max_frames` are dropped.
+    """
+    shutter_us = controls.get('ExposureTime')
+    if shutter_us is None:
+        picam2.set_controls(controls)
+        return None
+    baseline = picam2.capture_metadata().get('ExposureTime')
+    picam2.set_controls(controls)
+    previous = None
+    actual = None
+    for _ in range(max_frames):
+        actual = picam2.capture_metadata().get('ExposureTime')
+        if actual is None:
+            break
+        if abs(actual - shutter_us) <= tolerance * shutter_us:
+            break
+        if actual != baseline and actual == previous:
+            break
+        previous = actual
+    return actual
+
+
+def open_camera(camera, width, height, main_format=None, lores_size=None, buffer_count=None):
+    """Open and start a Picamera2 still session; None if unavailable.
+
+    `lores_size` adds a YUV420 lores stream, clamped to the main size. If
+    anything after acquiring the camera fails it is closed again, so the
+    caller's `rpicam-still` fallback doesn't find it busy.
+    """
+    if Picamera2 is None:
+        return None
+    picam2 = None
+    try:
+        picam2 = Picamera2(camera)
+        main = {"size": (width, height)}
+        if main_format is not None:
+            main["format"] = main_format
+        config = {"main": main}
+        if lores_size is not None:
+            config["lores"] = {"size": (min(lores_size[0], width), min(lores_size[1], height)), "format": "YUV420"}
+        if buffer_count is not None:
+            config["buffer_count"] = buffer_count
+        picam2.configure(picam2.create_still_configuration(**config))
+        picam2.options['quality'] = 95  # match rpicam-still --quality 95
+        picam2.start()
+    except Exception as e:
+        print(f'Picamera2 session for camera {camera} unavailable, falling back to rpicam-still:', e)
+        if picam2 is not None:
+            try:
+                picam2.close()
+            except Exception:
+                pass
+        return None
+    return picam2
+
+
+def close_camera(picam2):
+    if picam2 is None:
+        return
+    try:
+        picam2.stop()
+        picam2.close()
+    except Exception:
+        pass
@@ -1,19 +1,25 @@
 #!/usr/bin/env python3
 """rpicam-take.py
 
-Production capture script using `rpicam-still`.
+Production capture script. Captures through a single Picamera2 session kept
+open for the whole run, falling back to spawning `rpicam-still` per capture
+when Picamera2 is unavailable (or with `--use-rpicam-still`).
 
 Features implemented per spec:
 - Respects OFF/DEBUG pins (16,12). Aborts if OFF active.
 - Never toggles relays.
-- Uses `winter_camera.csv` (repo template present under `winter_scripts`) to store settings
-  and the last used exposure time (stored in microseconds).
+- Uses `winter_camera.csv` (repo template present under `winter_scripts`) to store settings.
+  The last used exposure time (microseconds) is saved to the `winter_camera.last.json`
+  sidecar next to it and used on the next run, unless the CSV's ExposureTime was
+  edited since; pass `--persist-csv` to also write it back into the CSV.
 - Runs an exposure_time_loop to converge shutter to a target mean brightness using
   multiplicative proportional adjustments, clamped by MinExposure/MaxExposure and
   limited per-iteration by MaxChangeFactor.
+- With `--bracket`, meters one geometric bracket of exposures around the last
+  exposure instead and interpolates the exposure that hits the target mean.
 - Attempts to lock autos by passing `--analoggain`, `--gain`, and `--awbgains` if present.
 - Saves final JPEG and writes a manifest CSV (`rpicam_take_manifest.csv`) in `--out-dir`.
-- Retries failing `rpicam-still` calls up to `RetryCount` times.
+- Retries a failing final capture up to `RetryCount` times.
 
 Usage (examples):
   python3 winter_scripts/rpicam-take.py --dry-run
@@ -27,6 +33,7 @@ Changes: Increased GammaExponent from 2.2 to 3.0 for stronger bright-side correc
          Saturated fast-drop and aggressive bright thresholds (0.05, threshold=10) remain active.
 """
 import argparse
+import atexit
 import csv
 import json
 import os
@@ -34,9 +41,29 @@ import subprocess
 import sys
 import time
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from PIL import Image, ImageStat
+import numpy as np
+from PIL import Image
+
+try:
+    from turbojpeg import TJPF_GRAY, TurboJPEG
+except Exception:
+    TJPF_GRAY = None
+    TurboJPEG = None
+
+try:
+    import orjson
+    _loads = orjson.loads
+except Exception:
+    orjson = None
+    _loads = json.loads
+
+try:
+    from picamera2 import MappedArray
+except Exception:
+    MappedArray = None
 
 # Ensure local package files are importable even when the script is executed
 # from a different current working directory (or when the folder name differs).
@@ -47,12 +74,27 @@ if str(SCRIPT_DIR) not in sys.path:
     sys.path.insert(0, str(SCRIPT_DIR))
 
 from gpio_safe import setup as gpio_setup, is_off, is_debug
+from picam_settle import close_camera, open_camera, set_controls_and_settle
 
 DEFAULT_CAMERA_CSV = os.path.join(os.path.dirname(__file__), "winter_camera.csv")
 DEFAULT_OUT_DIR = "/home/pi/Desktop/Mothbox/winter_images"
 MANIFEST_NAME = "rpicam_take_manifest.csv"
 LOG_PATH = os.path.join(os.path.dirname(__file__), "rpicam-take.log")
+# Low-res YUV420 stream metered on the Picamera2 path instead of decoding the JPEG
+LORES_SIZE = (640, 480)
+# Exposure multipliers metered around the last exposure in --bracket mode
+BRACKET_FACTORS = (0.25, 0.5, 1, 2, 4)
+# Means at or above this are treated as clipped and not used for interpolation
+SATURATED_MEAN = 250
 # Immediate disabled: do not use --immediate regardless of exposure length
+# Metadata keys per manifest column, in lookup order: rpicam-still JSON and
+# Picamera2 names first, then short aliases some builds emit
+ALIASES = {
+    'metadata_exposure_us': ('ExposureTime', 'exp', 'shutter'),
+    'metadata_analoggain': ('AnalogueGain', 'ag'),
+    'metadata_digitalgain': ('DigitalGain', 'dg'),
+    'metadata_awbgains': ('AwbGains', 'ColourGains', 'awbgains'),
+}
 
 
 def parse_args():
@@ -63,20 +105,46 @@ def parse_args():
     p.add_argument("--keep-intermediates", action='store_true', help="Keep intermediate loop images")
     p.add_argument("--width", type=int, help="Override width (px)")
     p.add_argument("--height", type=int, help="Override height (px)")
+    p.add_argument("--use-rpicam-still", action='store_true',
+                   help="Spawn rpicam-still per capture instead of keeping a Picamera2 session open")
+    p.add_argument("--persist-csv", action='store_true',
+                   help="Also rewrite the camera CSV with the new ExposureTime (default: sidecar JSON only)")
+    p.add_argument("--bracket", action='store_true',
+                   help="Meter one exposure bracket around the last exposure instead of running the iterative loop")
     return p.parse_args()
 
 
+def first_key(md, keys):
+    # first present, non-None value; a legitimate 0 is kept
+    for k in keys:
+        v = md.get(k)
+        if v is not None:
+            return v
+    return None
+
+
+def metadata_columns(md):
+    if not md:
+        return dict.fromkeys(ALIASES)
+    return {col: first_key(md, keys) for col, keys in ALIASES.items()}
+
+
 def read_camera_csv(path):
     settings = {}
     try:
         with open(path, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                return {}
+            # plain rows; column positions come from the header once
+            ki = header.index('SETTING') if 'SETTING' in header else 0
+            vi = header.index('VALUE') if 'VALUE' in header else 1
             for row in reader:
-                k = row.get('SETTING')
-                v = row.get('VALUE')
-                if k is None:
+                if len(row) <= ki or not row[ki]:
                     continue
-                settings[k] = v if v != '' else None
+                v = row[vi] if len(row) > vi else ''
+                settings[row[ki]] = v or None
     except FileNotFoundError:
         return {}
     return settings
@@ -106,6 +174,59 @@ def write_camera_csv(path, settings):
         writer.writerows(rows)
 
 
+def sidecar_path(camera_csv):
+    return Path(camera_csv).with_suffix('.last.json')
+
+
+def read_sidecar(camera_csv):
+    """Values saved by the last run (e.g. ExposureTime), as strings like the CSV.
+
+    Missing or unreadable sidecar -> empty dict.
+    """
+    try:
+        data = json.loads(sidecar_path(camera_csv).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {k: None if v is None else str(v) for k, v in data.items()}
+
+
+def starting_exposure(camera_csv, settings):
+    """Return (ExposureTime, source) for this run, source being 'sidecar' or 'csv'.
+
+    The sidecar records the CSV ExposureTime it was written against; once the
+    CSV value differs from that, the user edited it and the CSV wins. A
+    sidecar without that record is only used when it is newer than the CSV.
+    """
+    csv_value = settings.get('ExposureTime')
+    sidecar = read_sidecar(camera_csv)
+    if sidecar.get('ExposureTime'):
+        if 'CsvExposureTime' in sidecar:
+            current = sidecar['CsvExposureTime'] == csv_value
+        else:
+            try:
+                current = sidecar_path(camera_csv).stat().st_mtime >= Path(camera_csv).stat().st_mtime
+            except OSError:
+                current = False
+        if current:
+            return sidecar['ExposureTime'], 'sidecar'
+    return csv_value, 'csv'
+
+
+def write_sidecar(camera_csv, values):
+    try:
+        sidecar_path(camera_csv).write_text(json.dumps(values), encoding='utf-8')
+    except OSError as e:
+        print('Could not write', sidecar_path(camera_csv), '->', e)
+
+
+def manifest_filename(path, dry_run=False):
+    # intermediates are often metered without being saved; only name files
+    # that were written (a dry run records the planned name)
+    return str(path) if dry_run or Path(path).is_file() else ''
+
+
 def ensure_out_dir(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
@@ -128,52 +249,297 @@ def build_rpicam_cmd(out_path, shutter_us, width, height, camera_index=0, analog
     return cmd
 
 
+def _dumps(obj):
+    # compact C encoder when orjson is installed; stdlib for anything it rejects
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, default=str)
+
+
 def extract_json_from_stdout(stdout):
     try:
-        return json.loads(stdout)
+        return _loads(stdout)
     except Exception:
         start = stdout.find('{')
         end = stdout.rfind('}')
         if start != -1 and end != -1 and end > start:
             try:
-                return json.loads(stdout[start:end+1])
+                return _loads(stdout[start:end+1])
             except Exception:
                 return None
         return None
 
 
+_tj = None
+_tj_failed = False
+
+
+def _get_tj():
+    """Shared TurboJPEG decompressor, created on first use (None if libturbojpeg is missing)."""
+    global _tj, _tj_failed
+    if _tj is None and not _tj_failed and TurboJPEG is not None:
+        try:
+            _tj = TurboJPEG()
+        except Exception:
+            _tj_failed = True
+    return _tj
+
+
+def _turbo_mean(path):
+    """Gray 1/8-scale decode through PyTurboJPEG; None if unavailable or not a JPEG."""
+    tj = _get_tj()
+    if tj is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        gray = tj.decode(data, scaling_factor=(1, 8), pixel_format=TJPF_GRAY)
+    except Exception:
+        return None
+    return float(gray.mean())
+
+
 def mean_brightness_jpeg(path):
+    # Only steers the exposure controller, so let libjpeg decode luma at 1/8
+    # scale (DCT scaling, no full-size IDCT) and average it with NumPy.
     try:
-        im = Image.open(path).convert('L')
-        stat = ImageStat.Stat(im)
-        return float(stat.mean[0])
+        mean = _turbo_mean(path)
+        if mean is None:
+            with Image.open(path) as im:
+                im.draft('L', (im.width // 8, im.height // 8))
+                if im.mode != 'L':
+                    im = im.convert('L')
+                mean = float(np.asarray(im, dtype=np.uint8).mean())
     except Exception:
         return None
+    return mean
 
 
-def append_manifest(manifest_path, fieldnames, row):
-    exists = os.path.isfile(manifest_path)
-    with open(manifest_path, 'a', newline='') as f:
+# open manifest writers, keyed by (path, fieldnames); closed at exit
+_writers = {}
+
+
+def _manifest_writer(manifest_path, fieldnames):
+    key = (str(manifest_path), tuple(fieldnames))
+    entry = _writers.get(key)
+    if entry is None:
+        f = open(manifest_path, 'a', newline='')
         writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not exists:
+        if f.tell() == 0:
             writer.writeheader()
-        writer.writerow(row)
+        entry = _writers[key] = (f, writer)
+    return entry
+
+
+def _close_writers():
+    for f, _ in _writers.values():
+        try:
+            f.close()
+        except Exception:
+            pass
+    _writers.clear()
+
+
+atexit.register(_close_writers)
+
+
+def append_manifest(manifest_path, fieldnames, row):
+    append_manifest_rows(manifest_path, fieldnames, [row])
+
+
+def append_manifest_rows(manifest_path, fieldnames, rows):
+    # One open/append per run instead of one per row keeps SD card metadata churn down;
+    # the writer stays open and is flushed after each batch
+    if not rows:
+        return
+    f, writer = _manifest_writer(manifest_path, fieldnames)
+    writer.writerows(rows)
+    f.flush()
+
+
+def open_log():
+    # line-buffered: cron appends stdout to the same file, and lines must
+    # survive a kill during a long exposure
+    try:
+        return open(LOG_PATH, 'a', encoding='utf-8', buffering=1)
+    except Exception:
+        return None
+
+
+def log_line(log_file, text):
+    if log_file is None:
+        return
+    try:
+        log_file.write(text)
+    except Exception:
+        pass
 
 
 def run_capture_command(cmd, dry_run=False):
     if dry_run:
         return {'returncode': 'DRY-RUN', 'stdout': '', 'stderr': ''}
     try:
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        return {'returncode': proc.returncode, 'stdout': proc.stdout, 'stderr': proc.stderr}
+        # raw byte pipes: only the small JSON metadata is decoded, once, without
+        # text-mode newline translation
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+        return {'returncode': proc.returncode,
+                'stdout': proc.stdout.decode('utf-8', 'replace'),
+                'stderr': proc.stderr.decode('utf-8', 'replace')}
     except FileNotFoundError:
         return {'returncode': -1, 'stdout': '', 'stderr': 'rpicam-still not found'}
 
 
+def build_picam_controls(shutter_us, analoggain=None, gain=None, awbgains=None):
+    # Mirrors the rpicam-still flags: manual shutter, fixed gain and AWB when given
+    controls = {
+        'AeEnable': False,
+        'ExposureTime': int(shutter_us),
+        'FrameDurationLimits': (int(shutter_us), int(shutter_us)),
+    }
+    fixed_gain = analoggain if analoggain is not None else gain
+    if fixed_gain is not None:
+        controls['AnalogueGain'] = float(fixed_gain)
+    if awbgains is not None:
+        r_val, b_val = (float(p) for p in str(awbgains).split(','))
+        controls['AwbEnable'] = False
+        controls['ColourGains'] = (r_val, b_val)
+    return controls
+
+
+def lores_mean(req):
+    """Mean of the lores Y plane, read straight from the mapped DMA buffer."""
+    width, height = req.config['lores']['size']
+    with MappedArray(req, 'lores') as m:
+        # rows past `height` hold U/V; columns past `width` are stride padding
+        return float(m.array[:height, :width].mean())
+
+
+def run_picam_capture(picam2, out_path, controls, save=None):
+    """Capture one still on an open session; returns the same dict shape as
+    `run_capture_command` plus the request metadata under 'metadata' and the
+    lores brightness under 'mean'.
+
+    `save(mean)` decides whether the full-size image is written; None always
+    writes it. Skipping avoids a 64 MP JPEG encode for frames nobody keeps.
+    """
+    try:
+        set_controls_and_settle(picam2, controls)
+        req = picam2.capture_request()
+        try:
+            metadata = req.get_metadata()
+            try:
+                mean = lores_mean(req)
+            except Exception:
+                mean = None
+            if save is None or save(mean):
+                req.save('main', str(out_path))
+        finally:
+            req.release()
+    except Exception as e:
+        return {'returncode': -1, 'stdout': '', 'stderr': str(e), 'metadata': None, 'mean': None}
+    return {'returncode': 0, 'stdout': '', 'stderr': '', 'metadata': metadata, 'mean': mean}
+
+
+def capture_still(picam2, out_path, shutter_us, width, height, analoggain=None, gain=None, awbgains=None,
+                  dry_run=False, label='Capture', save=None):
+    """Capture via the open Picamera2 session, or via `rpicam-still` when there is none.
+
+    `save` is only honoured on the Picamera2 path (see `run_picam_capture`).
+    """
+    if picam2 is not None and not dry_run:
+        controls = build_picam_controls(shutter_us, analoggain=analoggain, gain=gain, awbgains=awbgains)
+        print(f'{label}: Picamera2 controls {controls} -> {out_path}')
+        return run_picam_capture(picam2, out_path, controls, save=save)
+    cmd = build_rpicam_cmd(out_path, shutter_us, width, height, camera_index=0,
+                           analoggain=analoggain, gain=gain, awbgains=awbgains,
+                           immediate=False)
+    print(f'{label}:', ' '.join(cmd))
+    return run_capture_command(cmd, dry_run=dry_run)
+
+
 def clamp(v, lo, hi):
     return max(lo, min(hi, v))
 
 
+def exposure_from_bracket(samples, target_mean):
+    """Pick the exposure expected to hit `target_mean` from (exposure_us, mean) samples.
+
+    Interpolates log(exposure) linearly against mean between the two samples
+    around the target (exact for a linear sensor response); outside the
+    measured range it scales the nearest sample proportionally.
+    """
+    valid = [(ex, m) for ex, m in samples if m is not None and 0 < m < SATURATED_MEAN]
+    if not valid:
+        return None
+    exps, means = np.array(valid, dtype=float).T
+    order = np.argsort(means)
+    exps, means = exps[order], means[order]
+    if target_mean <= means[0]:
+        return float(exps[0] * target_mean / means[0])
+    if target_mean >= means[-1]:
+        return float(exps[-1] * target_mean / means[-1])
+    return float(np.exp(np.interp(target_mean, means, np.log(exps))))
+
+
+def run_bracket(picam2, args, base_exposure, width, height, analoggain, gain, awbgains,
+                min_exposure, max_exposure, target_mean, manifest_rows, log_file):
+    """Meter a geometric bracket around `base_exposure` and return the exposure to use.
+
+    Replaces the iterative loop with one pass of back-to-back captures; on the
+    Picamera2 session only the lores stream is read, so no bracket image is saved.
+    """
+    exposures = sorted({clamp(int(round(base_exposure * f)), min_exposure, max_exposure) for f in BRACKET_FACTORS})
+    captured = []
+    # Bracket exposures don't depend on each other's brightness, so JPEG metering
+    # (rpicam-still path) runs on a worker while the next frame is exposing.
+    with ThreadPoolExecutor(max_workers=1) as meter:
+        for k, ex in enumerate(exposures, 1):
+            ts = time.strftime('%Y-%m-%d-%H-%M-%S')
+            tmp_name = Path(args.out_dir) / f"rpicam_{ts}_bracket{k}.jpg"
+            res = capture_still(picam2, tmp_name, ex, width, height,
+                                analoggain=analoggain, gain=gain, awbgains=awbgains,
+                                dry_run=args.dry_run, label=f'Bracket {k}: shutter {ex}us',
+                                save=lambda mean: args.keep_intermediates)
+            pending = None
+            if res.get('mean') is None and res.get('returncode') == 0 and tmp_name.is_file():
+                pending = meter.submit(mean_brightness_jpeg, tmp_name)
+            captured.append((k, ts, tmp_name, ex, res, pending))
+
+    samples = []
+    for k, ts, tmp_name, ex, res, pending in captured:
+        mean_b = pending.result() if pending is not None else res.get('mean')
+        samples.append((ex, mean_b))
+        manifest_rows.append({
+            'timestamp': ts, 'stage': f'bracket{k}', 'filename': manifest_filename(tmp_name, args.dry_run),
+            'requested_shutter_us': ex, 'requested_analoggain': analoggain,
+            'requested_gain': gain, 'requested_awbgains': awbgains,
+            'rpicam_returncode': res.get('returncode'), 'rpicam_stderr': res.get('stderr'),
+            'mean_brightness': mean_b,
+            'notes': '' if res.get('returncode') in (0, 'DRY-RUN') else f"capture failed (code {res.get('returncode')})"
+        })
+        if not args.keep_intermediates and tmp_name.is_file():
+            try:
+                tmp_name.unlink()
+            except Exception:
+                pass
+
+    if args.dry_run:
+        print('Dry-run mode: skipping exposure adjustments')
+        return base_exposure
+
+    picked = exposure_from_bracket(samples, target_mean)
+    if picked is None:
+        print('Bracket produced no usable brightness; keeping exposure', base_exposure)
+        return base_exposure
+    final_exposure = clamp(int(round(picked)), min_exposure, max_exposure)
+    print(f'Bracket means {samples} -> exposure {final_exposure}us for target {target_mean}')
+    log_line(log_file, f"{time.strftime('%Y-%m-%d-%H-%M-%S')} bracket samples={samples} new_exposure={final_exposure}\n")
+    return final_exposure
+
+
 def main():
     args = parse_args()
 
@@ -193,8 +559,11 @@ def main():
         return
 
     settings = read_camera_csv(args.camera_csv)
+    exposure_raw, exposure_source = starting_exposure(args.camera_csv, settings)
     # defaults and parsing
-    exposure_us = int(settings.get('ExposureTime') or settings.get('ExposureTime', 1000) or 1000)
+    exposure_us = int(exposure_raw or 1000)
+    exposure_from = sidecar_path(args.camera_csv) if exposure_source == 'sidecar' else args.camera_csv
+    print(f'Starting ExposureTime {exposure_us}us from {exposure_from}')
     analoggain = float(settings.get('AnalogueGain')) if settings.get('AnalogueGain') else None
     gain = float(settings.get('Gain')) if settings.get('Gain') else None
     awbgains_raw = settings.get('AwbGains') if settings.get('AwbGains') else None
@@ -242,273 +611,276 @@ def main():
         'metadata_awbgains', 'mean_brightness', 'notes'
     ]
 
-    # Exposure loop
-    current_exposure = clamp(exposure_us, min_exposure, max_exposure)
-    last_mean = None
-    last_error = None
-    settle_after_flip = 0
-    reuse_final = False
-    reused_file = None
-    reused_metadata = None
-    reused_returncode = None
-    reused_stderr = ''
-    reused_mean = None
-    reuse_iteration_stage = ''
-    for i in range(1, loop_iterations + 1):
-        ts = time.strftime('%Y-%m-%d-%H-%M-%S')
-        tmp_name = Path(args.out_dir) / f"rpicam_{ts}_iter{i}.jpg"
-        cmd = build_rpicam_cmd(tmp_name, current_exposure, width, height, camera_index=0,
-                   analoggain=analoggain, gain=gain, awbgains=awbgains,
-                   immediate=False)
-
-        print(f'Iteration {i}: running shutter {current_exposure}us ->', ' '.join(cmd))
-        res = run_capture_command(cmd, dry_run=args.dry_run)
-
-        metadata = extract_json_from_stdout(res.get('stdout') or '')
-        md_exposure = None
-        md_ag = None
-        md_dg = None
-        md_awb = None
-        if metadata:
-            md_exposure = metadata.get('ExposureTime') or metadata.get('exp') or metadata.get('shutter')
-            md_ag = metadata.get('AnalogueGain') or metadata.get('ag')
-            md_dg = metadata.get('DigitalGain') or metadata.get('dg')
-            md_awb = metadata.get('AwbGains') or metadata.get('awbgains')
-
-        mean_b = None
-        if res.get('returncode') == 0 and tmp_name.is_file():
-            mean_b = mean_brightness_jpeg(tmp_name)
-
-        notes = ''
-        if res.get('returncode') != 0:
-            notes = f"rpicam-still failed (code {res.get('returncode')})"
-
-        append_manifest(manifest, fieldnames, {
-            'timestamp': ts, 'stage': f'iter{i}', 'filename': str(tmp_name),
-            'requested_shutter_us': current_exposure, 'requested_analoggain': analoggain,
-            'requested_gain': gain, 'requested_awbgains': awbgains,
-            'rpicam_returncode': res.get('returncode'), 'rpicam_stderr': res.get('stderr'),
-            'metadata_json': json.dumps(metadata) if metadata else '', 'metadata_exposure_us': md_exposure,
-            'metadata_analoggain': md_ag, 'metadata_digitalgain': md_dg, 'metadata_awbgains': md_awb,
-            'mean_brightness': mean_b, 'notes': notes
-        })
-
-        # Log brightness & exposure factor to plain log file
-        try:
-            with open(LOG_PATH, 'a', encoding='utf-8') as lf:
-                lf.write(f"{ts} iter{i} exposure_us={current_exposure} mean={mean_b} returncode={res.get('returncode')}\n")
-        except Exception:
-            pass
-
-        # if dry-run, don't attempt adjustments
-        if args.dry_run:
-            print('Dry-run mode: skipping exposure adjustments')
-            break
-
-        if mean_b is None:
-            # capture failed or unreadable; try again in next iteration or exit
-            print('Capture failed or mean unknown; will retry loop or exit')
+    # One Picamera2 session serves every loop iteration and the final capture;
+    # spawning rpicam-still each time re-inits libcamera and re-runs 3A.
+    picam2 = None
+    if not args.dry_run and not args.use_rpicam_still:
+        picam2 = open_camera(0, width, height, main_format="RGB888", lores_size=LORES_SIZE)
+    # Manifest rows are buffered and written once; the log handle stays open
+    # for the run but writes through each line
+    manifest_rows = []
+    log_file = open_log()
+    log_line(log_file, f"{time.strftime('%Y-%m-%d-%H-%M-%S')} start exposure_us={exposure_us} source={exposure_from}\n")
+    try:
+        # Exposure loop
+        current_exposure = clamp(exposure_us, min_exposure, max_exposure)
+        last_mean = None
+        last_error = None
+        settle_after_flip = 0
+        reuse_final = False
+        reused_file = None
+        reused_metadata = None
+        reused_md_cols = metadata_columns(None)
+        reused_returncode = None
+        reused_stderr = ''
+        reused_mean = None
+        reuse_iteration_stage = ''
+
+        def within_tolerance(mean):
+            return target_mean <= 0 or abs(mean - target_mean) / target_mean * 100.0 <= tolerance_pct
+
+        def iteration_image_needed(mean):
+            # Full-size iteration images are only kept when they may become the
+            # final image (mirrors the reuse checks below) or on request.
+            if args.keep_intermediates or mean is None:
+                return True
+            return within_tolerance(mean) or (current_exposure <= min_exposure and mean > target_mean)
+
+        if args.bracket:
+            final_exposure = run_bracket(picam2, args, current_exposure, width, height, analoggain, gain, awbgains,
+                                         min_exposure, max_exposure, target_mean, manifest_rows, log_file)
         else:
-            last_mean = mean_b
-            # check tolerance
-            diff_pct = abs(mean_b - target_mean) / target_mean * 100.0 if target_mean > 0 else 0
-            if diff_pct <= tolerance_pct:
-                print(f'Mean brightness {mean_b} within tolerance {tolerance_pct}% of target {target_mean} -> reusing image')
-                final_exposure = current_exposure
-                reuse_final = True
-                reused_file = tmp_name
-                reused_metadata = metadata
-                reused_returncode = res.get('returncode')
-                reused_stderr = res.get('stderr')
-                reused_mean = mean_b
-                reuse_iteration_stage = f'iter{i}'
-                break
-            # Early stop: at MinExposure and still above target -> reuse current image
-            if current_exposure <= min_exposure and mean_b > target_mean:
-                print('Reached MinExposure while still above target brightness; stopping loop and reusing image')
-                final_exposure = current_exposure
-                reuse_final = True
-                reused_file = tmp_name
-                reused_metadata = metadata
-                reused_returncode = res.get('returncode')
-                reused_stderr = res.get('stderr')
-                reused_mean = mean_b
-                reuse_iteration_stage = f'iter{i}'
-                break
-            # Fast drop when saturated: if mean is extremely high, use the maximum allowed decrease
-            if mean_b >= 240:
-                factor = 1.0 / max_change
-                new_exposure = clamp(int(round(current_exposure * factor)), min_exposure, max_exposure)
-                print(f'Adjusting exposure (saturated): {current_exposure} -> {new_exposure} (factor {factor:.3f})')
-                try:
-                    with open(LOG_PATH, 'a', encoding='utf-8') as lf:
-                        lf.write(f"{ts} iter{i} factor={factor:.3f} new_exposure={new_exposure} [saturated]\n")
-                except Exception:
-                    pass
-                current_exposure = new_exposure
-                last_error = target_mean - mean_b
-                settle_after_flip = 0
-                continue
-            # Dynamic gamma adjustment bounded by CSV GammaExponent
-            error = target_mean - mean_b  # positive => too dark
+            for i in range(1, loop_iterations + 1):
+                ts = time.strftime('%Y-%m-%d-%H-%M-%S')
+                tmp_name = Path(args.out_dir) / f"rpicam_{ts}_iter{i}.jpg"
+                res = capture_still(picam2, tmp_name, current_exposure, width, height,
+                                    analoggain=analoggain, gain=gain, awbgains=awbgains,
+                                    dry_run=args.dry_run, label=f'Iteration {i}: shutter {current_exposure}us',
+                                    save=iteration_image_needed)
+
+                metadata = res.get('metadata') or extract_json_from_stdout(res.get('stdout') or '')
+                md_cols = metadata_columns(metadata)
+
+                mean_b = res.get('mean')
+                if mean_b is None and res.get('returncode') == 0 and tmp_name.is_file():
+                    mean_b = mean_brightness_jpeg(tmp_name)
+
+                notes = ''
+                if res.get('returncode') != 0:
+                    notes = f"rpicam-still failed (code {res.get('returncode')})"
+
+                manifest_rows.append({
+                    'timestamp': ts, 'stage': f'iter{i}', 'filename': manifest_filename(tmp_name, args.dry_run),
+                    'requested_shutter_us': current_exposure, 'requested_analoggain': analoggain,
+                    'requested_gain': gain, 'requested_awbgains': awbgains,
+                    'rpicam_returncode': res.get('returncode'), 'rpicam_stderr': res.get('stderr'),
+                    'metadata_json': _dumps(metadata) if metadata else '', **md_cols,
+                    'mean_brightness': mean_b, 'notes': notes
+                })
+
+                # Log brightness & exposure factor to plain log file
+                log_line(log_file, f"{ts} iter{i} exposure_us={current_exposure} mean={mean_b} returncode={res.get('returncode')}\n")
+
+                # if dry-run, don't attempt adjustments
+                if args.dry_run:
+                    print('Dry-run mode: skipping exposure adjustments')
+                    break
+
+                if mean_b is None:
+                    # capture failed or unreadable; try again in next iteration or exit
+                    print('Capture failed or mean unknown; will retry loop or exit')
+                else:
+                    last_mean = mean_b
+                    # check tolerance
+                    if within_tolerance(mean_b):
+                        print(f'Mean brightness {mean_b} within tolerance {tolerance_pct}% of target {target_mean} -> reusing image')
+                        final_exposure = current_exposure
+                        reuse_final = True
+                        reused_file = tmp_name
+                        reused_metadata = metadata
+                        reused_md_cols = md_cols
+                        reused_returncode = res.get('returncode')
+                        reused_stderr = res.get('stderr')
+                        reused_mean = mean_b
+                        reuse_iteration_stage = f'iter{i}'
+                        break
+                    # Early stop: at MinExposure and still above target -> reuse current image
+                    if current_exposure <= min_exposure and mean_b > target_mean:
+                        print('Reached MinExposure while still above target brightness; stopping loop and reusing image')
+                        final_exposure = current_exposure
+                        reuse_final = True
+                        reused_file = tmp_name
+                        reused_metadata = metadata
+                        reused_md_cols = md_cols
+                        reused_returncode = res.get('returncode')
+                        reused_stderr = res.get('stderr')
+                        reused_mean = mean_b
+                        reuse_iteration_stage = f'iter{i}'
+                        break
+                    # Fast drop when saturated: if mean is extremely high, use the maximum allowed decrease
+                    if mean_b >= 240:
+                        factor = 1.0 / max_change
+                        new_exposure = clamp(int(round(current_exposure * factor)), min_exposure, max_exposure)
+                        print(f'Adjusting exposure (saturated): {current_exposure} -> {new_exposure} (factor {factor:.3f})')
+                        log_line(log_file, f"{ts} iter{i} factor={factor:.3f} new_exposure={new_exposure} [saturated]\n")
+                        current_exposure = new_exposure
+                        last_error = target_mean - mean_b
+                        settle_after_flip = 0
+                        continue
+                    # Dynamic gamma adjustment bounded by CSV GammaExponent
+                    error = target_mean - mean_b  # positive => too dark
             
-            # Select GammaTransitionError based on current brightness
-            if mean_b < (target_mean - gamma_dark_threshold):
-                gamma_transition = gamma_transition_dark
-            elif mean_b > (target_mean + gamma_bright_threshold):
-                gamma_transition = gamma_transition_bright
-            else:
-                gamma_transition = gamma_transition_normal
+                    # Select GammaTransitionError based on current brightness
+                    if mean_b < (target_mean - gamma_dark_threshold):
+                        gamma_transition = gamma_transition_dark
+                    elif mean_b > (target_mean + gamma_bright_threshold):
+                        gamma_transition = gamma_transition_bright
+                    else:
+                        gamma_transition = gamma_transition_normal
             
-            norm_error = error / target_mean if target_mean > 0 else 0.0
-            abs_norm = abs(norm_error)
-            scale = abs_norm / gamma_transition
-            if scale < 0:
-                scale = 0
-            if scale > 1:
-                scale = 1
-            gamma_dynamic = 1.0 + (gamma - 1.0) * scale
-            factor = ((target_mean / mean_b) ** gamma_dynamic) if mean_b > 0 else max_change
-            # Overshoot damping: if error sign flips, limit change magnitude for a couple iterations
-            if last_error is not None and ((error > 0) != (last_error > 0)):
-                settle_after_flip = 2
-            if settle_after_flip > 0:
-                delta = factor - 1.0
-                max_delta = 0.25
-                if delta > max_delta:
-                    factor = 1.0 + max_delta
-                elif delta < -max_delta:
-                    factor = 1.0 - max_delta
-                settle_after_flip -= 1
-            # limit change factor
-            factor = clamp(factor, 1.0 / max_change, max_change)
-            new_exposure = int(round(current_exposure * factor))
-            new_exposure = clamp(new_exposure, min_exposure, max_exposure)
-            print(f'Adjusting exposure: {current_exposure} -> {new_exposure} (factor {factor:.3f})')
-            # Log factor change
-            try:
-                with open(LOG_PATH, 'a', encoding='utf-8') as lf:
-                    lf.write(f"{ts} iter{i} factor={factor:.3f} new_exposure={new_exposure}\n")
-            except Exception:
-                pass
-            current_exposure = new_exposure
-            last_error = error
+                    norm_error = error / target_mean if target_mean > 0 else 0.0
+                    abs_norm = abs(norm_error)
+                    scale = abs_norm / gamma_transition
+                    if scale < 0:
+                        scale = 0
+                    if scale > 1:
+                        scale = 1
+                    gamma_dynamic = 1.0 + (gamma - 1.0) * scale
+                    factor = ((target_mean / mean_b) ** gamma_dynamic) if mean_b > 0 else max_change
+                    # Overshoot damping: if error sign flips, limit change magnitude for a couple iterations
+                    if last_error is not None and ((error > 0) != (last_error > 0)):
+                        settle_after_flip = 2
+                    if settle_after_flip > 0:
+                        delta = factor - 1.0
+                        max_delta = 0.25
+                        if delta > max_delta:
+                            factor = 1.0 + max_delta
+                        elif delta < -max_delta:
+                            factor = 1.0 - max_delta
+                        settle_after_flip -= 1
+                    # limit change factor
+                    factor = clamp(factor, 1.0 / max_change, max_change)
+                    new_exposure = int(round(current_exposure * factor))
+                    new_exposure = clamp(new_exposure, min_exposure, max_exposure)
+                    print(f'Adjusting exposure: {current_exposure} -> {new_exposure} (factor {factor:.3f})')
+                    # Log factor change
+                    log_line(log_file, f"{ts} iter{i} factor={factor:.3f} new_exposure={new_exposure}\n")
+                    current_exposure = new_exposure
+                    last_error = error
+
+                    # If we've hit max exposure and still below target, stop looping
+                    if current_exposure >= max_exposure and mean_b < target_mean:
+                        print('Reached MaxExposure without achieving target brightness; stopping loop early')
+                        final_exposure = current_exposure
+                        break
+
+                # optionally remove intermediate
+                if not args.keep_intermediates and Path(tmp_name).is_file():
+                    try:
+                        Path(tmp_name).unlink()
+                    except Exception:
+                        pass
 
-            # If we've hit max exposure and still below target, stop looping
-            if current_exposure >= max_exposure and mean_b < target_mean:
-                print('Reached MaxExposure without achieving target brightness; stopping loop early')
+            else:
+                # loop exhausted without early break
                 final_exposure = current_exposure
-                break
 
-        # optionally remove intermediate
-        if not args.keep_intermediates and Path(tmp_name).is_file():
+        # If dry-run was requested, we already printed commands and should exit
+        if args.dry_run:
+            print('Dry-run complete — no final capture performed')
+            return
+
+        # Final capture with retries
+        final_ts = time.strftime('%Y-%m-%d-%H-%M-%S')
+        # Prepare final filename with brightness suffix if known
+        final_mean_label = None
+        if reuse_final and reused_mean is not None:
+            final_mean_label = int(round(reused_mean))
+        base_final_name = f"rpicam_{final_ts}_ex{final_exposure}us"
+        if final_mean_label is not None:
+            base_final_name += f"_mean{final_mean_label}"
+        final_name = Path(args.out_dir) / (base_final_name + '.jpg')
+        # If we are reusing an iteration image, rename/copy instead of capturing again
+        if reuse_final and reused_file and reused_file.is_file():
+            # Hardlink when keeping intermediates, rename otherwise; both are
+            # metadata-only. Byte copy only when the link/rename is refused.
             try:
-                Path(tmp_name).unlink()
+                try:
+                    if args.keep_intermediates:
+                        os.link(reused_file, final_name)
+                    else:
+                        os.replace(reused_file, final_name)
+                except OSError:
+                    shutil.copy2(reused_file, final_name)
+                    if not args.keep_intermediates:
+                        reused_file.unlink()
             except Exception:
                 pass
-
-    else:
-        # loop exhausted without early break
-        final_exposure = current_exposure
-
-    # If dry-run was requested, we already printed commands and should exit
-    if args.dry_run:
-        print('Dry-run complete — no final capture performed')
-        return
-
-    # Final capture with retries
-    final_ts = time.strftime('%Y-%m-%d-%H-%M-%S')
-    # Prepare final filename with brightness suffix if known
-    final_mean_label = None
-    if reuse_final and reused_mean is not None:
-        final_mean_label = int(round(reused_mean))
-    base_final_name = f"rpicam_{final_ts}_ex{final_exposure}us"
-    if final_mean_label is not None:
-        base_final_name += f"_mean{final_mean_label}"
-    final_name = Path(args.out_dir) / (base_final_name + '.jpg')
-    # If we are reusing an iteration image, rename/copy instead of capturing again
-    if reuse_final and reused_file and reused_file.is_file():
-        # Decide rename vs copy
-        try:
-            if args.keep_intermediates:
-                shutil.copy2(reused_file, final_name)
-            else:
-                reused_file.rename(final_name)
-        except Exception:
-            pass
-        # Append final manifest row using reused data
-        append_manifest(manifest, fieldnames, {
-            'timestamp': final_ts, 'stage': 'final(reused)', 'filename': str(final_name),
-            'requested_shutter_us': final_exposure, 'requested_analoggain': analoggain,
-            'requested_gain': gain, 'requested_awbgains': awbgains,
-            'rpicam_returncode': reused_returncode,
-            'rpicam_stderr': reused_stderr,
-            'metadata_json': json.dumps(reused_metadata) if reused_metadata else '',
-            'metadata_exposure_us': reused_metadata.get('ExposureTime') if reused_metadata else None,
-            'metadata_analoggain': reused_metadata.get('AnalogueGain') if reused_metadata else None,
-            'metadata_digitalgain': reused_metadata.get('DigitalGain') if reused_metadata else None,
-            'metadata_awbgains': reused_metadata.get('AwbGains') if reused_metadata else None,
-            'mean_brightness': reused_mean, 'notes': f'Reused from {reuse_iteration_stage}'
-        })
-        # Log reuse
-        try:
-            with open(LOG_PATH, 'a', encoding='utf-8') as lf:
-                lf.write(f"{final_ts} final reuse exposure_us={final_exposure} mean={reused_mean}\n")
-        except Exception:
-            pass
-    else:
-        final_cmd = build_rpicam_cmd(final_name, final_exposure, width, height, camera_index=0,
-                         analoggain=analoggain, gain=gain, awbgains=awbgains,
-                         immediate=False)
-
-        attempt = 0
-        final_res = None
-        while attempt <= retry_count:
-            attempt += 1
-            print(f'Final capture attempt {attempt}:', ' '.join(final_cmd))
-            final_res = run_capture_command(final_cmd, dry_run=args.dry_run)
-            if final_res.get('returncode') == 0:
-                break
-            print('Final capture failed:', final_res.get('stderr'))
-
-        # collect final metadata and mean
-        metadata = extract_json_from_stdout(final_res.get('stdout') or '') if final_res else None
-        md_exposure = metadata.get('ExposureTime') if metadata else None
-        md_ag = metadata.get('AnalogueGain') if metadata else None
-        md_dg = metadata.get('DigitalGain') if metadata else None
-        md_awb = metadata.get('AwbGains') if metadata else None
-        mean_b_final = None
-        if final_res and final_res.get('returncode') == 0 and final_name.is_file():
-            mean_b_final = mean_brightness_jpeg(final_name)
-            if final_mean_label is None and mean_b_final is not None:
-                final_mean_label = int(round(mean_b_final))
-                renamed = Path(args.out_dir) / f"rpicam_{final_ts}_ex{final_exposure}us_mean{final_mean_label}.jpg"
-                try:
-                    final_name.rename(renamed)
-                    final_name = renamed
-                except Exception:
-                    pass
-
-        append_manifest(manifest, fieldnames, {
-            'timestamp': final_ts, 'stage': 'final', 'filename': str(final_name),
-            'requested_shutter_us': final_exposure, 'requested_analoggain': analoggain,
-            'requested_gain': gain, 'requested_awbgains': awbgains,
-            'rpicam_returncode': final_res.get('returncode') if final_res else 'NO-RESULT',
-            'rpicam_stderr': final_res.get('stderr') if final_res else '',
-            'metadata_json': json.dumps(metadata) if metadata else '', 'metadata_exposure_us': md_exposure,
-            'metadata_analoggain': md_ag, 'metadata_digitalgain': md_dg, 'metadata_awbgains': md_awb,
-            'mean_brightness': mean_b_final, 'notes': ''
-        })
-        # Log final brightness
-        try:
-            with open(LOG_PATH, 'a', encoding='utf-8') as lf:
-                lf.write(f"{final_ts} final exposure_us={final_exposure} mean={mean_b_final} returncode={final_res.get('returncode') if final_res else 'NO-RESULT'}\n")
-        except Exception:
-            pass
-
-    # update camera csv with new ExposureTime
-    settings['ExposureTime'] = str(final_exposure)
-    write_camera_csv(args.camera_csv, settings)
+            # Append final manifest row using reused data
+            manifest_rows.append({
+                'timestamp': final_ts, 'stage': 'final(reused)', 'filename': str(final_name),
+                'requested_shutter_us': final_exposure, 'requested_analoggain': analoggain,
+                'requested_gain': gain, 'requested_awbgains': awbgains,
+                'rpicam_returncode': reused_returncode,
+                'rpicam_stderr': reused_stderr,
+                'metadata_json': _dumps(reused_metadata) if reused_metadata else '',
+                **reused_md_cols,
+                'mean_brightness': reused_mean, 'notes': f'Reused from {reuse_iteration_stage}'
+            })
+            # Log reuse
+            log_line(log_file, f"{final_ts} final reuse exposure_us={final_exposure} mean={reused_mean}\n")
+        else:
+            attempt = 0
+            final_res = None
+            while attempt <= retry_count:
+                attempt += 1
+                final_res = capture_still(picam2, final_name, final_exposure, width, height,
+                                          analoggain=analoggain, gain=gain, awbgains=awbgains,
+                                          dry_run=args.dry_run, label=f'Final capture attempt {attempt}')
+                if final_res.get('returncode') == 0:
+                    break
+                print('Final capture failed:', final_res.get('stderr'))
+
+            # collect final metadata and mean
+            metadata = (final_res.get('metadata') or extract_json_from_stdout(final_res.get('stdout') or '')) if final_res else None
+            md_cols = metadata_columns(metadata)
+            mean_b_final = None
+            if final_res and final_res.get('returncode') == 0 and final_name.is_file():
+                mean_b_final = mean_brightness_jpeg(final_name)
+                if final_mean_label is None and mean_b_final is not None:
+                    final_mean_label = int(round(mean_b_final))
+                    renamed = Path(args.out_dir) / f"rpicam_{final_ts}_ex{final_exposure}us_mean{final_mean_label}.jpg"
+                    try:
+                        final_name.rename(renamed)
+                        final_name = renamed
+                    except Exception:
+                        pass
+
+            manifest_rows.append({
+                'timestamp': final_ts, 'stage': 'final', 'filename': str(final_name),
+                'requested_shutter_us': final_exposure, 'requested_analoggain': analoggain,
+                'requested_gain': gain, 'requested_awbgains': awbgains,
+                'rpicam_returncode': final_res.get('returncode') if final_res else 'NO-RESULT',
+                'rpicam_stderr': final_res.get('stderr') if final_res else '',
+                'metadata_json': _dumps(metadata) if metadata else '', **md_cols,
+                'mean_brightness': mean_b_final, 'notes': ''
+            })
+            # Log final brightness
+            log_line(log_file, f"{final_ts} final exposure_us={final_exposure} mean={mean_b_final} returncode={final_res.get('returncode') if final_res else 'NO-RESULT'}\n")
+    finally:
+        close_camera(picam2)
+        append_manifest_rows(manifest, fieldnames, manifest_rows)
+        if log_file is not None:
+            log_file.close()
+
+    # Persist the new ExposureTime to the small sidecar; the full CSV is only
+    # rewritten on request so routine runs don't re-serialize it on the SD card.
+    if args.persist_csv:
+        settings['ExposureTime'] = str(final_exposure)
+        write_camera_csv(args.camera_csv, settings)
+    # record the CSV value too, so a later hand edit of the CSV takes precedence
+    write_sidecar(args.camera_csv, {'ExposureTime': final_exposure,
+                                    'CsvExposureTime': settings.get('ExposureTime')})
 
     print('Capture complete. Final exposure (us):', final_exposure)
 
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
-"""Run diagnostic captures using the `rpicam-still` command-line tool.
+"""Run diagnostic captures over a grid of exposure times and EV values.
 
-This script iterates exposure times (seconds) and EV values and invokes
-`rpicam-still` for each combination, saving images to the output directory.
+This script iterates exposure times (seconds) and EV values and captures each
+combination, saving images to the output directory. Captures use one
+persistent Picamera2 session per camera when picamera2 is available;
+`--use-rpicam-still` (or a missing picamera2) invokes `rpicam-still` per
+combination instead.
 
 It assumes the Arducam 64MP maximum resolution (9248x6944). It sets the
 program timeout large enough to accommodate long shutter speeds.
@@ -12,11 +15,19 @@ Usage examples:
   python3 rpicam-test.py --exposure-times 0.01 1 5 --exposure-values -2 2 2 --dry-run
 """
 import argparse
+import math
 import time
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import product
 from pathlib import Path
 import subprocess
 
+import numpy as np
+
+from picam_settle import close_camera, open_camera, set_controls_and_settle
+
 DEFAULT_WIDTH = 9248
 DEFAULT_HEIGHT = 6944
 
@@ -31,34 +42,30 @@ def parse_args():
                    help="Run a single capture with TIME (s) and EV")
     p.add_argument("--out-dir", default=os.environ.get('MOTHBOX_OUT','/tmp/mothbox_ext'),
                    help="Directory to save captures")
-    p.add_argument("--camera", type=int, default=0, help="Camera index to pass to rpicam-still")
+    p.add_argument("--camera", type=int, nargs='+', default=[0],
+                   help="Camera index(es) to pass to rpicam-still; several indices capture concurrently")
     p.add_argument("--dry-run", action='store_true', help="Do not call rpicam-still; print commands")
     p.add_argument("--nopreview", action='store_true', help="Pass nopreview to rpicam-still")
+    p.add_argument("--verbose", action='store_true',
+                   help="Keep rpicam-still stderr for every capture (default: only for failed captures)")
+    p.add_argument("--use-rpicam-still", action='store_true',
+                   help="Spawn rpicam-still per capture instead of keeping a Picamera2 session open")
     return p.parse_args()
 
 
 def linspace(start, stop, count):
     if count <= 1:
         return [start]
-    step = (stop - start) / (count - 1)
-    return [start + i * step for i in range(int(count))]
+    return np.linspace(start, stop, int(count)).tolist()
 
 
 def frange(start, stop, step):
-    vals = []
     if step == 0:
         return [start]
-    v = start
-    eps = 1e-12
-    if step > 0:
-        while v <= stop + eps:
-            vals.append(v)
-            v += step
-    else:
-        while v >= stop - eps:
-            vals.append(v)
-            v += step
-    return vals
+    # Count the steps up front and scale them, rather than accumulating
+    # `v += step`, so float drift can't drop or add the endpoint.
+    n = max(int(math.floor((stop - start) / step + 1e-9)) + 1, 0)
+    return (start + step * np.arange(n)).tolist()
 
 
 def warn_about_ranges(ev, ex_s):
@@ -76,22 +83,13 @@ def ensure_out_dir(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
 
-def build_rpicam_cmd(out_path, shutter_s, ev, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, camera=0, nopreview=False):
-    # rpicam-still expects shutter in microseconds when no units provided
-    shutter_us = int(round(shutter_s * 1e6))
-
-    # Program timeout (-t) needs to be at least shutter duration (ms) + margin
-    timeout_ms = max(5000, int(shutter_s * 1000 + 5000))
-
+def base_rpicam_cmd(width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, camera=0, nopreview=False):
+    """The part of the rpicam-still command that is fixed for a whole sweep."""
     cmd = [
         "rpicam-still",
         "--camera", str(camera),
         "--width", str(width),
         "--height", str(height),
-        "--shutter", str(shutter_us),
-        "--ev", str(ev),
-        "-t", f"{timeout_ms}ms",
-        "-o", str(out_path),
         "--quality", "95",
     ]
     if nopreview:
@@ -100,38 +98,134 @@ def build_rpicam_cmd(out_path, shutter_s, ev, width=DEFAULT_WIDTH, height=DEFAUL
     else:
         # ensure no preview by default cli may show preview; pass nopreview anyway
         cmd += ["--nopreview", "1"]
-    return cmd
+    return tuple(cmd)
 
 
-def run_sequence(exposure_times, evs, out_dir, camera_index=0, dry_run=False, nopreview=True):
-    ensure_out_dir(out_dir)
-    for ex_s in exposure_times:
-        for ev in evs:
-            notes = warn_about_ranges(ev, ex_s)
-            print("---")
-            print(f"Planned: shutter={ex_s}s EV={ev} -> warnings: {notes}")
+def build_rpicam_cmd(base, out_path, shutter_s, ev):
+    # rpicam-still expects shutter in microseconds when no units provided
+    shutter_us = int(round(shutter_s * 1e6))
+
+    # Program timeout (-t) needs to be at least shutter duration (ms) + margin
+    timeout_ms = max(5000, int(shutter_s * 1000 + 5000))
+
+    return [
+        *base,
+        "--shutter", str(shutter_us),
+        "--ev", str(ev),
+        "-t", f"{timeout_ms}ms",
+        "-o", str(out_path),
+    ]
 
-            dt = time.strftime('%Y-%m-%d-%H-%M-%S')
-            fname = Path(out_dir) / f"rpicam_{dt}_ex{ex_s:.3f}s_ev{ev:+.2f}.jpg"
-            cmd = build_rpicam_cmd(fname, ex_s, ev, camera=camera_index, nopreview=nopreview)
 
-            if dry_run:
-                print("DRY-RUN cmd:", " ".join(cmd))
-                continue
+def run_rpicam(cmd, verbose=False):
+    """Run rpicam-still; returns (returncode, stdout, stderr).
 
-            print("Running:", " ".join(cmd))
+    stderr is mostly progress output, so it is collected as raw bytes and only
+    decoded when the capture failed or `verbose` is set ('' otherwise).
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=-1)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0 or verbose:
+        stderr = stderr.decode(errors='replace')
+    else:
+        stderr = ''
+    return proc.returncode, stdout.decode(errors='replace'), stderr
+
+
+def capture_picam(picam2, fname, shutter_s, ev):
+    shutter_us = int(round(shutter_s * 1e6))
+    # Like `rpicam-still --shutter`: only the shutter is fixed and AGC keeps
+    # running, so ExposureValue still moves the gain. New controls land a few
+    # frames later; drop frames until they're in effect.
+    set_controls_and_settle(picam2, {
+        "ExposureTime": shutter_us,
+        "FrameDurationLimits": (shutter_us, shutter_us),
+        "ExposureValue": float(ev),
+    })
+    req = picam2.capture_request()
+    try:
+        req.save("main", fname)
+        return req.get_metadata()
+    finally:
+        req.release()
+
+
+def _run_one(ex_s, ev, out_dir, base, dry_run, gate, picam2=None, verbose=False):
+    notes = warn_about_ranges(ev, ex_s)
+    print("---")
+    print(f"Planned: shutter={ex_s}s EV={ev} -> warnings: {notes}")
+
+    dt = time.strftime('%Y-%m-%d-%H-%M-%S')
+    fname = f"{out_dir}/rpicam_{dt}_ex{ex_s:.3f}s_ev{ev:+.2f}.jpg"
+
+    if picam2 is not None:
+        # one capture at a time per sensor
+        with gate:
             try:
-                proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-                if proc.returncode != 0:
-                    print("rpicam-still returned code", proc.returncode)
-                    print("stderr:", proc.stderr)
-                else:
-                    print("Saved:", fname)
-                    if proc.stdout:
-                        print(proc.stdout)
-            except FileNotFoundError:
-                print("rpicam-still not found on PATH. Install it on the Pi and retry.")
+                metadata = capture_picam(picam2, fname, ex_s, ev)
+            except Exception as e:
+                print("Capture failed:", e)
                 return
+        print("Saved:", fname)
+        print(metadata)
+        return
+
+    cmd = build_rpicam_cmd(base, fname, ex_s, ev)
+
+    if dry_run:
+        print("DRY-RUN cmd:", " ".join(cmd))
+        return
+
+    print("Running:", " ".join(cmd))
+    with gate:
+        returncode, stdout, stderr = run_rpicam(cmd, verbose=verbose)
+    if returncode != 0:
+        print("rpicam-still returned code", returncode)
+        print("stderr:", stderr)
+    else:
+        print("Saved:", fname)
+        if stdout:
+            print(stdout)
+        if stderr:
+            print(stderr)
+
+
+def run_sequence(exposure_times, evs, out_dir, camera_index=(0,), dry_run=False, nopreview=True,
+                 use_rpicam_still=False, verbose=False):
+    ensure_out_dir(out_dir)
+    # plain string prefix for per-capture filenames; no Path built per capture
+    out_dir = str(Path(out_dir))
+    combos = list(product(exposure_times, evs))
+    if not combos:
+        return
+    cameras = [camera_index] if isinstance(camera_index, int) else list(camera_index)
+    # Captures block in C (libcamera or the rpicam-still child), so threads
+    # suffice; one worker and lock per camera keeps each sensor to one capture
+    # while other cameras run concurrently.
+    gates = {cam: threading.Lock() for cam in cameras}
+    bases = {cam: base_rpicam_cmd(camera=cam, nopreview=nopreview) for cam in cameras}
+    workers = max(1, min(len(combos), len(cameras)))
+    # one persistent session per camera; a camera that fails to open uses rpicam-still
+    sessions = {}
+    if not dry_run and not use_rpicam_still:
+        sessions = {cam: open_camera(cam, DEFAULT_WIDTH, DEFAULT_HEIGHT, buffer_count=2) for cam in cameras}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for k, (ex_s, ev) in enumerate(combos):
+                cam = cameras[k % len(cameras)]
+                futures.append(pool.submit(_run_one, ex_s, ev, out_dir, bases[cam], dry_run, gates[cam],
+                                           sessions.get(cam), verbose))
+            for fut in as_completed(futures):
+                try:
+                    fut.result()
+                except FileNotFoundError:
+                    print("rpicam-still not found on PATH. Install it on the Pi and retry.")
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    return
+    finally:
+        for picam2 in sessions.values():
+            close_camera(picam2)
 
 
 def main():
@@ -152,7 +246,8 @@ def main():
     print("Output dir:", args.out_dir)
     print("Resolution:", DEFAULT_WIDTH, "x", DEFAULT_HEIGHT)
 
-    run_sequence(exposure_times, evs, args.out_dir, camera_index=args.camera, dry_run=args.dry_run, nopreview=args.nopreview)
+    run_sequence(exposure_times, evs, args.out_dir, camera_index=args.camera, dry_run=args.dry_run, nopreview=args.nopreview,
+                 use_rpicam_still=args.use_rpicam_still, verbose=args.verbose)
 
 
 if __name__ == '__main__':
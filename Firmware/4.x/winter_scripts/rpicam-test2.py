@@ -1,25 +1,63 @@
 #!/usr/bin/env python3
 """rpicam-test2.py
 
-Calls `rpicam-still` for combinations of shutter and EV, captures JSON metadata,
+Captures combinations of shutter and EV, records the capture metadata,
 computes mean JPEG brightness, and writes a CSV manifest per capture. Attempts
 to lock auto settings by passing fixed gain and AWB when requested.
 
+JPEGs are metered in memory and only written to --out-dir with `--save`.
+
+Captures go through one persistent Picamera2 session per camera when
+picamera2 is available; `--use-rpicam-still` (or a missing picamera2) spawns
+`rpicam-still` per capture and parses its JSON metadata instead.
+
 JPEG only (no RAW). CSV columns include timestamp, filename, requested values,
 actual metadata (as JSON) and derived mean_brightness.
 """
 import argparse
 import csv
+import io
 import json
+import math
 import os
 import subprocess
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import product
 from pathlib import Path
 
-from PIL import Image, ImageStat
+import numpy as np
+from PIL import Image
+
+try:
+    import simplejpeg
+except Exception:
+    simplejpeg = None
+
+try:
+    import orjson
+    _loads = orjson.loads
+except Exception:
+    orjson = None
+    _loads = json.loads
+
+try:
+    from picamera2 import MappedArray
+except Exception:
+    MappedArray = None
+
+from picam_settle import close_camera, open_camera, set_controls_and_settle
 
 DEFAULT_WIDTH = 9248
 DEFAULT_HEIGHT = 6944
+# Metering decodes at 1/METER_SCALE per side via libjpeg's DCT scaling; the
+# mean of the reduced image tracks the full-res mean closely
+METER_SCALE = 8
+# Manifest is held open for the sweep and flushed every this many rows
+MANIFEST_FLUSH_ROWS = 10
+# Low-res YUV420 stream metered on the Picamera2 path instead of decoding the JPEG
+LORES_SIZE = (640, 480)
 
 
 def parse_args():
@@ -32,62 +70,69 @@ def parse_args():
                    help="Run a single capture with TIME (s) and EV")
     p.add_argument("--out-dir", default=os.environ.get('MOTHBOX_OUT','/tmp/mothbox_ext'),
                    help="Directory to save captures")
-    p.add_argument("--camera", type=int, default=0, help="Camera index to pass to rpicam-still")
+    p.add_argument("--camera", type=int, nargs='+', default=[0],
+                   help="Camera index(es) to pass to rpicam-still; several indices capture concurrently")
     p.add_argument("--dry-run", action='store_true', help="Do not call rpicam-still; print commands")
     p.add_argument("--nopreview", action='store_true', help="Pass nopreview to rpicam-still")
     p.add_argument("--analoggain", type=float, default=None, help="Fix analog gain (sets --analoggain)")
     p.add_argument("--gain", type=float, default=None, help="Fix gain (sets --gain)")
     p.add_argument("--awbgains", type=str, default=None, help="Fix AWB gains as 'R,G' (sets --awbgains)")
     p.add_argument("--manifest", default='rpicam_manifest.csv', help="CSV manifest path (appended)")
-    return p.parse_args()
+    p.add_argument("--meter-width", type=int, default=None,
+                   help=f"Capture the sweep at this width for metering (default {DEFAULT_WIDTH}; e.g. {DEFAULT_WIDTH // 8})")
+    p.add_argument("--meter-height", type=int, default=None,
+                   help=f"Capture the sweep at this height for metering (default {DEFAULT_HEIGHT}; e.g. {DEFAULT_HEIGHT // 8})")
+    p.add_argument("--defer-metering", action='store_true',
+                   help="Decode the saved JPEGs for brightness after the sweep on a process pool instead of "
+                        "alongside it (requires --save)")
+    p.add_argument("--save", action='store_true',
+                   help="Also write each JPEG to --out-dir (default: meter from memory, keep only the manifest)")
+    p.add_argument("--verbose", action='store_true',
+                   help="Keep rpicam-still stderr for every capture (default: only for failed captures)")
+    p.add_argument("--use-rpicam-still", action='store_true',
+                   help="Spawn rpicam-still per capture instead of keeping a Picamera2 session open")
+    args = p.parse_args()
+    # deferring in-memory JPEGs would hold every frame of the sweep in RAM
+    if args.defer_metering and not args.save:
+        p.error("--defer-metering reads the JPEGs back from disk; add --save")
+    return args
 
 
 def linspace(start, stop, count):
     if count <= 1:
         return [start]
-    step = (stop - start) / (count - 1)
-    return [start + i * step for i in range(int(count))]
+    return np.linspace(start, stop, int(count)).tolist()
 
 
 def frange(start, stop, step):
-    vals = []
     if step == 0:
         return [start]
-    v = start
-    eps = 1e-12
-    if step > 0:
-        while v <= stop + eps:
-            vals.append(v)
-            v += step
-    else:
-        while v >= stop - eps:
-            vals.append(v)
-            v += step
-    return vals
+    # Count the steps up front and scale them, rather than accumulating
+    # `v += step`, so float drift can't drop or add the endpoint.
+    n = max(int(math.floor((stop - start) / step + 1e-9)) + 1, 0)
+    return (start + step * np.arange(n)).tolist()
 
 
 def ensure_out_dir(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
 
-def build_rpicam_cmd(out_path, shutter_s, ev, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, camera=0, nopreview=True,
-                     analoggain=None, gain=None, awbgains=None):
-    shutter_us = int(round(shutter_s * 1e6))
-    timeout_ms = max(5000, int(shutter_s * 1000 + 5000))
+def base_rpicam_cmd(width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, camera=0, nopreview=True,
+                    analoggain=None, gain=None, awbgains=None, metadata_stdout=True):
+    """The part of the rpicam-still command that is fixed for a whole sweep.
 
+    With `metadata_stdout` False the JPEG owns stdout and the caller adds its
+    own `--metadata` target per capture.
+    """
     cmd = [
         "rpicam-still",
         "--camera", str(camera),
         "--width", str(width),
         "--height", str(height),
-        "--shutter", str(shutter_us),
-        "--ev", str(ev),
-        "-t", f"{timeout_ms}ms",
-        "-o", str(out_path),
         "--quality", "95",
-        "--metadata", "-",
         "--metadata-format", "json",
     ]
+    cmd += ["--metadata", "-"] if metadata_stdout else []
 
     # try to suppress preview
     cmd += ["--nopreview", "1"] if nopreview else []
@@ -99,127 +144,388 @@ def build_rpicam_cmd(out_path, shutter_s, ev, width=DEFAULT_WIDTH, height=DEFAUL
     if awbgains is not None:
         cmd += ["--awbgains", str(awbgains)]
 
-    return cmd
+    return tuple(cmd)
+
+
+def build_rpicam_cmd(base, out_path, shutter_s, ev):
+    # only the per-capture fields are formatted here
+    shutter_us = int(round(shutter_s * 1e6))
+    timeout_ms = max(5000, int(shutter_s * 1000 + 5000))
+    return [
+        *base,
+        "--shutter", str(shutter_us),
+        "--ev", str(ev),
+        "-t", f"{timeout_ms}ms",
+        "-o", str(out_path),
+    ]
+
+
+def run_rpicam(cmd, verbose=False):
+    """Run rpicam-still; returns (returncode, stdout, stderr).
+
+    stderr is mostly progress output, so it is collected as raw bytes and only
+    decoded when the capture failed or `verbose` is set ('' otherwise).
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=-1)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0 or verbose:
+        stderr = stderr.decode(errors='replace')
+    else:
+        stderr = ''
+    return proc.returncode, stdout.decode(errors='replace'), stderr
+
+
+def run_rpicam_stream(cmd, verbose=False):
+    """Run rpicam-still with `-o -`; returns (returncode, jpeg, metadata, stderr).
+
+    The JPEG comes back as bytes on stdout; the metadata JSON is written to a
+    pipe passed in as `--metadata /dev/fd/N` and drained on a thread so neither
+    pipe can fill up and stall the child. stderr is handled as in run_rpicam.
+    """
+    r_fd, w_fd = os.pipe()
+    chunks = []
+    try:
+        proc = subprocess.Popen([*cmd, "--metadata", f"/dev/fd/{w_fd}"], stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, pass_fds=(w_fd,), bufsize=-1)
+    except BaseException:
+        os.close(r_fd)
+        os.close(w_fd)
+        raise
+    # only the child holds the write end now, so the reader sees EOF when it exits
+    os.close(w_fd)
+    with open(r_fd, 'rb') as meta_f:
+        reader = threading.Thread(target=lambda: chunks.append(meta_f.read()), daemon=True)
+        reader.start()
+        jpeg, stderr = proc.communicate()
+        reader.join()
+    metadata = b''.join(chunks).decode(errors='replace')
+    if proc.returncode != 0 or verbose:
+        stderr = stderr.decode(errors='replace')
+    else:
+        stderr = ''
+    return proc.returncode, jpeg, metadata, stderr
+
+
+def _dumps(obj):
+    # compact C encoder when orjson is installed; stdlib for anything it rejects
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, default=str)
 
 
 def extract_json_from_stdout(stdout):
     try:
-        return json.loads(stdout)
+        return _loads(stdout)
     except Exception:
         # try to extract first {...} block
         start = stdout.find('{')
         end = stdout.rfind('}')
         if start != -1 and end != -1 and end > start:
             try:
-                return json.loads(stdout[start:end+1])
+                return _loads(stdout[start:end+1])
             except Exception:
                 return None
         return None
 
 
-def mean_brightness_jpeg(path):
+def mean_brightness_jpeg(src):
+    """Mean luma of a JPEG given as a path or as the encoded bytes."""
+    in_memory = isinstance(src, (bytes, bytearray, memoryview))
+    # libjpeg-turbo straight to grayscale when simplejpeg is installed
+    if simplejpeg is not None:
+        try:
+            if in_memory:
+                buf = src
+            else:
+                with open(src, 'rb') as f:
+                    buf = f.read()
+            # min_factor only takes effect with min_height/min_width set; the
+            # defaults of 0 keep the decode at full size
+            gray = simplejpeg.decode_jpeg(buf, colorspace='GRAY', min_height=1, min_width=1,
+                                          min_factor=METER_SCALE)
+            return float(np.mean(gray, dtype=np.float64))
+        except Exception:
+            pass
+    # Pillow fallback; draft() has the decoder emit reduced-size luma only,
+    # no convert('L') copy
     try:
-        im = Image.open(path).convert('L')
-        stat = ImageStat.Stat(im)
-        return float(stat.mean[0])
+        with Image.open(io.BytesIO(src) if in_memory else src) as im:
+            im.draft('L', (im.width // METER_SCALE, im.height // METER_SCALE))
+            if im.mode != 'L':
+                im = im.convert('L')
+            return float(np.asarray(im, dtype=np.uint8).mean())
     except Exception:
         return None
 
 
-def append_manifest(manifest_path, row, fieldnames):
-    exists = os.path.isfile(manifest_path)
-    with open(manifest_path, 'a', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not exists:
-            writer.writeheader()
-        writer.writerow(row)
+def build_picam_controls(shutter_s, ev, analoggain=None, gain=None, awbgains=None):
+    # Like the rpicam-still flags: --shutter fixes only the shutter and leaves
+    # AGC running, so EV still moves the gain; AE goes off only when a gain
+    # is fixed as well (EV then has nothing left to adjust)
+    shutter_us = int(round(shutter_s * 1e6))
+    controls = {
+        'ExposureTime': shutter_us,
+        'FrameDurationLimits': (shutter_us, shutter_us),
+        'ExposureValue': float(ev),
+    }
+    fixed_gain = analoggain if analoggain is not None else gain
+    if fixed_gain is not None:
+        controls['AeEnable'] = False
+        controls['AnalogueGain'] = float(fixed_gain)
+    if awbgains is not None:
+        r_val, b_val = (float(p) for p in str(awbgains).split(','))
+        controls['AwbEnable'] = False
+        controls['ColourGains'] = (r_val, b_val)
+    return controls
 
 
-def run_sequence(exposure_times, evs, out_dir, args):
-    ensure_out_dir(out_dir)
-    manifest = Path(out_dir) / args.manifest
-    # manifest columns
-    fieldnames = [
-        'timestamp', 'filename', 'requested_shutter_s', 'requested_ev', 'requested_analoggain', 'requested_gain', 'requested_awbgains',
-        'rpicam_returncode', 'rpicam_stderr', 'metadata_json', 'metadata_exposure_us', 'metadata_analoggain', 'metadata_digitalgain',
-        'metadata_awbgains', 'mean_brightness'
-    ]
+def lores_mean(req):
+    """Mean of the lores Y plane, read straight from the mapped DMA buffer."""
+    width, height = req.config['lores']['size']
+    with MappedArray(req, 'lores') as m:
+        # rows past `height` hold U/V; columns past `width` are stride padding
+        return float(m.array[:height, :width].mean())
 
-    for ex_s in exposure_times:
-        for ev in evs:
-            ts = time.strftime('%Y-%m-%d-%H-%M-%S')
-            fname = Path(out_dir) / f"rpicam_{ts}_ex{ex_s:.3f}s_ev{ev:+.2f}.jpg"
-            cmd = build_rpicam_cmd(fname, ex_s, ev, camera=args.camera, nopreview=True,
-                                   analoggain=args.analoggain, gain=args.gain, awbgains=args.awbgains)
-
-            print('---')
-            print('Planned:', ' '.join(cmd))
-            if args.dry_run:
-                # write empty/placeholder manifest row for dry-run
-                row = {
-                    'timestamp': ts,
-                    'filename': str(fname),
-                    'requested_shutter_s': ex_s,
-                    'requested_ev': ev,
-                    'requested_analoggain': args.analoggain,
-                    'requested_gain': args.gain,
-                    'requested_awbgains': args.awbgains,
-                    'rpicam_returncode': 'DRY-RUN',
-                    'rpicam_stderr': '',
-                    'metadata_json': '',
-                    'metadata_exposure_us': '',
-                    'metadata_analoggain': '',
-                    'metadata_digitalgain': '',
-                    'metadata_awbgains': '',
-                    'mean_brightness': ''
-                }
-                append_manifest(manifest, row, fieldnames)
-                continue
 
+def capture_picam(picam2, fname, controls):
+    """Capture one still on an open session.
+
+    Returns (returncode, stderr, metadata, mean); the brightness comes from the
+    lores luma of the same request, so no JPEG is decoded. The main stream is
+    only encoded and saved when `fname` is set.
+    """
+    try:
+        # new controls land a few frames later; drop frames until they're in effect
+        set_controls_and_settle(picam2, controls)
+        req = picam2.capture_request()
+        try:
+            metadata = req.get_metadata()
             try:
-                proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-            except FileNotFoundError:
-                print('rpicam-still not found on PATH. Install it on the Pi and retry.')
-                return
-
-            metadata = extract_json_from_stdout(proc.stdout or '')
-
-            metadata_exposure_us = None
-            metadata_analoggain = None
-            metadata_digitalgain = None
-            metadata_awb = None
-            if metadata:
-                # try common keys
-                metadata_exposure_us = metadata.get('ExposureTime') or metadata.get('exp') or metadata.get('shutter')
-                metadata_analoggain = metadata.get('AnalogueGain') or metadata.get('ag')
-                metadata_digitalgain = metadata.get('DigitalGain') or metadata.get('dg')
-                # awb gains may be returned under different keys
-                metadata_awb = metadata.get('AwbGains') or metadata.get('awbgains') or None
-
-            mean_b = None
-            if proc.returncode == 0 and Path(fname).is_file():
-                mean_b = mean_brightness_jpeg(fname)
-
-            row = {
-                'timestamp': ts,
-                'filename': str(fname),
-                'requested_shutter_s': ex_s,
-                'requested_ev': ev,
-                'requested_analoggain': args.analoggain,
-                'requested_gain': args.gain,
-                'requested_awbgains': args.awbgains,
-                'rpicam_returncode': proc.returncode,
-                'rpicam_stderr': (proc.stderr or '').strip(),
-                'metadata_json': json.dumps(metadata) if metadata is not None else '',
-                'metadata_exposure_us': metadata_exposure_us,
-                'metadata_analoggain': metadata_analoggain,
-                'metadata_digitalgain': metadata_digitalgain,
-                'metadata_awbgains': metadata_awb,
-                'mean_brightness': mean_b
-            }
-
-            append_manifest(manifest, row, fieldnames)
-            print('Wrote manifest row for', fname)
+                mean = lores_mean(req)
+            except Exception:
+                mean = None
+            if fname:
+                req.save('main', fname)
+        finally:
+            req.release()
+    except Exception as e:
+        return -1, str(e), None, None
+    return 0, '', metadata, mean
+
+
+MANIFEST_FIELDS = [
+    'timestamp', 'filename', 'requested_shutter_s', 'requested_ev', 'requested_analoggain', 'requested_gain', 'requested_awbgains',
+    'rpicam_returncode', 'rpicam_stderr', 'metadata_json', 'metadata_exposure_us', 'metadata_analoggain', 'metadata_digitalgain',
+    'metadata_awbgains', 'mean_brightness'
+]
+
+
+def _run_one(ex_s, ev, out_dir, args, base, gate, analyzer, picam2=None):
+    """Capture one (shutter, EV) combination, on `picam2` when given.
+
+    Returns its manifest row and the pending brightness future (or None); the
+    decode runs on `analyzer` so this thread can start the next capture. With
+    `analyzer` None the saved JPEG path comes back instead, for `meter_deferred`.
+    """
+    ts = time.strftime('%Y-%m-%d-%H-%M-%S')
+    fname = f"{out_dir}/rpicam_{ts}_ex{ex_s:.3f}s_ev{ev:+.2f}.jpg" if args.save else ''
+
+    print('---')
+    if picam2 is not None:
+        controls = build_picam_controls(ex_s, ev, analoggain=args.analoggain, gain=args.gain,
+                                        awbgains=args.awbgains)
+        print('Planned: Picamera2', controls, '->', fname or '(not saved)')
+        # one capture at a time per sensor
+        with gate:
+            returncode, stderr, metadata, mean = capture_picam(picam2, fname, controls)
+        return _finish_row(ts, fname, ex_s, ev, args, returncode, stderr, metadata, analyzer, mean)
+
+    # without --save the JPEG is streamed back on stdout and never touches disk
+    cmd = build_rpicam_cmd(base, fname or '-', ex_s, ev)
+    print('Planned:', ' '.join(cmd))
+    if args.dry_run:
+        # empty/placeholder manifest row for dry-run
+        return ({
+            'timestamp': ts,
+            'filename': fname,
+            'requested_shutter_s': ex_s,
+            'requested_ev': ev,
+            'requested_analoggain': args.analoggain,
+            'requested_gain': args.gain,
+            'requested_awbgains': args.awbgains,
+            'rpicam_returncode': 'DRY-RUN',
+            'rpicam_stderr': '',
+            'metadata_json': '',
+            'metadata_exposure_us': '',
+            'metadata_analoggain': '',
+            'metadata_digitalgain': '',
+            'metadata_awbgains': '',
+            'mean_brightness': ''
+        }, None)
+
+    # The gate is held only until the child exits; the worker waiting on it
+    # launches the next rpicam-still while this one parses and queues its decode.
+    jpeg = None
+    with gate:
+        if fname:
+            returncode, stdout, stderr = run_rpicam(cmd, verbose=args.verbose)
+        else:
+            returncode, jpeg, stdout, stderr = run_rpicam_stream(cmd, verbose=args.verbose)
+
+    metadata = extract_json_from_stdout(stdout)
+    return _finish_row(ts, fname, ex_s, ev, args, returncode, stderr.strip(), metadata, analyzer, jpeg=jpeg)
+
+
+# Manifest column -> metadata keys to try, in order (rpicam-still JSON and
+# Picamera2 names first, then short aliases some builds emit)
+_KEYMAP = {
+    'metadata_exposure_us': ('ExposureTime', 'exp', 'shutter'),
+    'metadata_analoggain': ('AnalogueGain', 'ag'),
+    'metadata_digitalgain': ('DigitalGain', 'dg'),
+    'metadata_awbgains': ('AwbGains', 'ColourGains', 'awbgains'),
+}
+
+
+def _pick(md, keys):
+    # first key present wins, so a reported 0 isn't skipped the way `or` would
+    return next((md[k] for k in keys if k in md), None)
+
+
+def _finish_row(ts, fname, ex_s, ev, args, returncode, stderr, metadata, analyzer, mean=None, jpeg=None):
+    md = metadata or {}
+    md_cols = {col: _pick(md, keys) for col, keys in _KEYMAP.items()}
+
+    # what's left to meter: the streamed bytes, else the saved file; with no
+    # analyzer the source itself is handed back for meter_deferred
+    pending = None
+    if mean is None and returncode == 0:
+        if jpeg:
+            pending = jpeg
+        elif fname and os.path.isfile(fname):
+            pending = fname
+    if analyzer is not None and pending is not None:
+        pending = analyzer.submit(mean_brightness_jpeg, pending)
+
+    return ({
+        'timestamp': ts,
+        'filename': fname,
+        'requested_shutter_s': ex_s,
+        'requested_ev': ev,
+        'requested_analoggain': args.analoggain,
+        'requested_gain': args.gain,
+        'requested_awbgains': args.awbgains,
+        'rpicam_returncode': returncode,
+        'rpicam_stderr': stderr,
+        'metadata_json': _dumps(metadata) if metadata is not None else '',
+        **md_cols,
+        'mean_brightness': mean
+    }, pending)
+
+
+def _pin_worker():
+    """Pool initializer: keep analysis off core 0 and below capture priority.
+
+    Core 0 is left to libcamera / rpicam-still. On Linux both calls act on the
+    calling thread, so this works for thread and process pools alike.
+    """
+    try:
+        cores = os.sched_getaffinity(0) - {0}
+        if cores:
+            os.sched_setaffinity(0, cores)
+        os.nice(5)
+    except (AttributeError, OSError):
+        pass
+
+
+def meter_deferred(items):
+    """Fill in mean_brightness from (row, JPEG path) pairs, one process per core but one."""
+    todo = [(row, src) for row, src in items if src is not None]
+    if not todo:
+        return
+    workers = max(1, (os.cpu_count() or 1) - 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_pin_worker) as pool:
+        for (row, _), mean in zip(todo, pool.map(mean_brightness_jpeg, [src for _, src in todo])):
+            row['mean_brightness'] = mean
+
+
+def run_sequence(exposure_times, evs, out_dir, args):
+    ensure_out_dir(out_dir)
+    manifest = Path(out_dir) / args.manifest
+    # plain string prefix for per-capture filenames; no Path built per capture
+    out_dir = str(Path(out_dir))
+
+    combos = list(product(exposure_times, evs))
+    if not combos:
+        return
+    cameras = args.camera
+    # Capture calls block in C (libcamera or the rpicam-still child) and the
+    # JPEG decode releases the GIL, so threads are enough. Capture workers
+    # only capture (two per camera, so the next capture is queued on the
+    # camera's lock while the previous result is handled; combinations spread
+    # round-robin); the decodes go to a separate analyzer so they overlap the
+    # next exposure.
+    gates = {cam: threading.Lock() for cam in cameras}
+    # Brightness vs shutter doesn't need 64 MP; a smaller output lets the
+    # sensor use a binned mode and shrinks readout, encode and decode alike.
+    width = args.meter_width or DEFAULT_WIDTH
+    height = args.meter_height or DEFAULT_HEIGHT
+    bases = {cam: base_rpicam_cmd(width=width, height=height, camera=cam, nopreview=True, analoggain=args.analoggain,
+                                  gain=args.gain, awbgains=args.awbgains, metadata_stdout=args.save)
+             for cam in cameras}
+    workers = max(1, min(len(combos), 2 * len(cameras)))
+    # one persistent session per camera; a camera that fails to open uses rpicam-still
+    sessions = {}
+    if not args.dry_run and not args.use_rpicam_still:
+        sessions = {cam: open_camera(cam, width, height, lores_size=LORES_SIZE, buffer_count=2) for cam in cameras}
+    # --defer-metering: hold rows until the sweep is done, then decode the
+    # saved files all at once on worker processes
+    deferred = [] if args.defer_metering else None
+    try:
+        with open(manifest, 'a', newline='') as manifest_f, \
+                ThreadPoolExecutor(max_workers=2, initializer=_pin_worker) as analyzer, \
+                ThreadPoolExecutor(max_workers=workers) as pool:
+            writer = csv.DictWriter(manifest_f, fieldnames=MANIFEST_FIELDS)
+            if manifest_f.tell() == 0:
+                writer.writeheader()
+            futures = []
+            for k, (ex_s, ev) in enumerate(combos):
+                cam = cameras[k % len(cameras)]
+                futures.append(pool.submit(_run_one, ex_s, ev, out_dir, args, bases[cam], gates[cam],
+                                           analyzer if deferred is None else None, sessions.get(cam)))
+            # manifest rows are written from this thread only, once the mean is
+            # in, and in combination order; later captures keep running while
+            # an earlier one is awaited
+            for n, fut in enumerate(futures, 1):
+                try:
+                    row, pending = fut.result()
+                except FileNotFoundError:
+                    print('rpicam-still not found on PATH. Install it on the Pi and retry.')
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    break
+                if deferred is not None:
+                    deferred.append((row, pending))
+                    continue
+                if pending is not None:
+                    row['mean_brightness'] = pending.result()
+                writer.writerow(row)
+                if n % MANIFEST_FLUSH_ROWS == 0:
+                    manifest_f.flush()
+                if not args.dry_run:
+                    print('Wrote manifest row for', row['filename'] or f"{row['requested_shutter_s']}s EV{row['requested_ev']}")
+            if deferred:
+                # cameras are done; free them before the CPU-bound pass
+                for picam2 in sessions.values():
+                    close_camera(picam2)
+                sessions = {}
+                meter_deferred(deferred)
+                writer.writerows(row for row, _ in deferred)
+                print(f'Wrote {len(deferred)} manifest rows')
+    finally:
+        for picam2 in sessions.values():
+            close_camera(picam2)
 
 
 def main():
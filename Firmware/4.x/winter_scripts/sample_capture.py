@@ -5,13 +5,27 @@ preferred lifecycle: load settings -> check hardware gates -> (dry-run or) use
 Picamera2 to capture -> save to a timestamped file. It respects OFF/DEBUG pins.
 """
 import argparse
+import atexit
 import time
 from pathlib import Path
 
+import numpy as np
+
+# Try to use picamera2 if available; do_capture fails gracefully without it
+_PICAMERA2_ERROR = None
+try:
+    from picamera2 import Picamera2
+except Exception as e:
+    Picamera2 = None
+    _PICAMERA2_ERROR = e
+
 from config_loader import load_camera_settings, read_controls
 from gpio_safe import setup, is_off, is_debug, require_armed
 from defaults import USE_LIGHTS, CAMERA_MODULE, CAMERA_DOC_URL, DEFAULT_OUTPUT_DIR
 
+# Picamera2 session shared by every do_capture call; opened on first use
+_CAM = None
+
 
 def parse_args():
     p = argparse.ArgumentParser()
@@ -25,6 +39,32 @@ def make_output_dir(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
 
+def _get_cam():
+    """Return the shared, started Picamera2 session, opening it on first use."""
+    global _CAM
+    if _CAM is None:
+        cam = Picamera2()
+        # minimal safe configuration: still capture, small size; a spare
+        # buffer keeps the pipeline filling while one is being read
+        cam.configure(cam.create_still_configuration(main={"size": (1024, 768)}, buffer_count=3))
+        cam.start()
+        _CAM = cam
+    return _CAM
+
+
+def _close_cam():
+    # stop the session only at interpreter exit, not after each capture
+    if _CAM is not None:
+        try:
+            _CAM.stop()
+            _CAM.close()
+        except Exception:
+            pass
+
+
+atexit.register(_close_cam)
+
+
 @require_armed
 def do_capture(dry_run, out_dir, controls_path):
     # load repo-style settings
@@ -50,24 +90,23 @@ def do_capture(dry_run, out_dir, controls_path):
         return
 
     # Try to use picamera2 if available; otherwise fail gracefully.
-    try:
-        from picamera2 import Picamera2
-    except Exception as e:
-        print("Picamera2 not available: ", e)
+    if Picamera2 is None:
+        print("Picamera2 not available: ", _PICAMERA2_ERROR)
         print("Aborting real capture. Use --dry-run for simulation.")
         return
 
-    picam2 = Picamera2()
-    # minimal safe configuration: still capture, small size
-    picam2.configure(picam2.create_still_configuration(main={"size": (1024, 768)}))
-    picam2.start()
-    im = picam2.capture_array()
-    picam2.stop()
+    picam2 = _get_cam()
 
     # save numpy array to a simple file for example (avoid depending on Pillow here)
-    import numpy as np
-
-    np.save(str(filename.with_suffix('.npy')), im)
+    # stream the frame out with write_array while the request is held; the
+    # request goes back to libcamera as soon as the file is written
+    req = picam2.capture_request()
+    try:
+        arr = req.make_array("main")
+        with open(filename.with_suffix('.npy'), 'wb') as f:
+            np.lib.format.write_array(f, arr, allow_pickle=False)
+    finally:
+        req.release()
     print("Saved sample capture to", filename.with_suffix('.npy'))
 
 